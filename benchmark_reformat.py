@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+""" Compares tokenizer.reformat_tokens, which builds the whole output in
+memory, with tokenizer.write_reformatted, which writes it to a file as the
+tokens are consumed, and with baseline_reformat_tokens, a copy of the
+original list-accumulating reformat_tokens they both replace.
+
+Throughput is measured on tokens lexed beforehand so that only the
+reformatting is timed. Peak memory is measured end to end, reading the
+source from disk and writing the output to disk, if tracemalloc is
+available.
+
+Usage: benchmark_reformat.py [size in MB]
+
+"""
+from __future__ import print_function
+
+import os
+import sys
+import tempfile
+import timeit
+
+from javalang import tokenizer
+from javalang.tokenizer import Identifier, Keyword, Literal, Operator
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+SAMPLE = os.path.join(os.path.dirname(tokenizer.__file__),
+                      'test', 'source', 'tokenizer', 'Tokens.java')
+
+
+def baseline_reformat_tokens(tokens):
+    """ reformat_tokens as it was before write_reformatted was added, kept
+    unchanged as the reference case.
+
+    """
+
+    indent = 0
+    closed_block = False
+    ident_last = False
+
+    output = list()
+
+    for token in tokens:
+        if closed_block:
+            closed_block = False
+            indent -= 4
+
+            output.append('\n')
+            output.append(' ' * indent)
+            output.append('}')
+
+            if isinstance(token, (Literal, Keyword, Identifier)):
+                output.append('\n')
+                output.append(' ' * indent)
+
+        if token.value == '{':
+            indent += 4
+            output.append(' {\n')
+            output.append(' ' * indent)
+
+        elif token.value == '}':
+            closed_block = True
+
+        elif token.value == ',':
+            output.append(', ')
+
+        elif isinstance(token, (Literal, Keyword, Identifier)):
+            if ident_last:
+                # If the last token was a literla/keyword/identifer put a space in between
+                output.append(' ')
+            ident_last = True
+            output.append(token.value)
+
+        elif isinstance(token, Operator):
+            output.append(' ' + token.value + ' ')
+
+        elif token.value == ';':
+            output.append(';\n')
+            output.append(' ' * indent)
+
+        else:
+            output.append(token.value)
+
+        ident_last = isinstance(token, (Literal, Keyword, Identifier))
+
+    if closed_block:
+        output.append('\n}')
+
+    output.append('\n')
+
+    return ''.join(output)
+
+
+def throughput(name, size, function):
+    elapsed = min(timeit.repeat(function, number=1, repeat=3))
+    print('%-24s %8.2f MB/s' % (name, size / 1e6 / elapsed))
+
+
+def peak_memory(name, function):
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print('%-24s %8.1f MB peak' % (name, peak / 1e6))
+
+
+def main():
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 4
+
+    with open(SAMPLE, 'rb') as f:
+        sample = f.read().decode('utf-8')
+
+    code = sample * (int(megabytes * 1e6 / len(sample)) + 1)
+    size = len(code)
+
+    handle, source = tempfile.mkstemp(suffix='.java')
+    output = source + '.out'
+
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            f.write(code.encode('utf-8'))
+
+        tokens = list(tokenizer.tokenize(code))
+        del code
+
+        # All three must produce the same text for the timings to compare
+        expected = baseline_reformat_tokens(tokens)
+        assert tokenizer.reformat_tokens(tokens) == expected
+        del expected
+
+        def baseline_tokens():
+            with open(output, 'w') as f:
+                f.write(baseline_reformat_tokens(tokens))
+
+        def join_tokens():
+            with open(output, 'w') as f:
+                f.write(tokenizer.reformat_tokens(tokens))
+
+        def write_tokens():
+            with open(output, 'w') as f:
+                tokenizer.write_reformatted(tokens, f)
+
+        print('Reformatting %.1f MB, %d tokens' % (size / 1e6, len(tokens)))
+        throughput('baseline_reformat_tokens', size, baseline_tokens)
+        throughput('reformat_tokens', size, join_tokens)
+        throughput('write_reformatted', size, write_tokens)
+
+        del tokens
+
+        def baseline():
+            with open(source, 'rb') as f:
+                text = baseline_reformat_tokens(tokenizer.tokenize(f.read()))
+
+            with open(output, 'w') as f:
+                f.write(text)
+
+        def in_memory():
+            with open(source, 'rb') as f:
+                text = tokenizer.reformat_tokens(tokenizer.tokenize(f.read()))
+
+            with open(output, 'w') as f:
+                f.write(text)
+
+        def streaming():
+            with open(output, 'w') as f:
+                tokenizer.write_reformatted(tokenizer.tokenize_file(source), f)
+
+        if tracemalloc is not None:
+            peak_memory('baseline_reformat_tokens', baseline)
+            peak_memory('reformat_tokens', in_memory)
+            peak_memory('write_reformatted', streaming)
+    finally:
+        os.remove(source)
+
+        if os.path.exists(output):
+            os.remove(output)
+
+
+if __name__ == '__main__':
+    main()
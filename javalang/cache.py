@@ -0,0 +1,231 @@
+import errno
+import hashlib
+import os
+import pickle
+import tempfile
+import zlib
+
+import six
+
+from . import __version__
+from .parser import Parser
+from .tokenizer import token_stream
+
+
+class SourceCache(object):
+    """ A content addressed cache of token streams and syntax trees on disk.
+
+    Entries are keyed by a hash of the source, the javalang version and the
+    options the entry was produced with, so a source which has not changed
+    since a previous run is neither lexed nor parsed again. Each entry is a
+    compressed pickle stored under a subdirectory named by the first two
+    characters of its key.
+
+    If max_size is given the least recently used entries are removed once the
+    entries take up more than max_size bytes. An entry counts as used when it
+    is written or read.
+
+    """
+
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        self.max_size = max_size
+
+        # Total size of the entries, counted on the first write
+        self.size = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, code, *options):
+        digest = hashlib.sha1()
+        digest.update(__version__.encode('ascii'))
+
+        for option in options:
+            digest.update(b'\0')
+            digest.update(option.encode('ascii'))
+
+        digest.update(b'\0')
+
+        if isinstance(code, six.text_type):
+            if six.PY2:
+                code = code.encode('utf-8')
+            else:
+                code = code.encode('utf-8', 'surrogatepass')
+
+        digest.update(code)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def get(self, key):
+        """ Returns the value stored under key or None if there is none. """
+
+        path = self.path(key)
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+
+        try:
+            value = pickle.loads(zlib.decompress(data))
+        except Exception:
+            # Written by an incompatible version or damaged, drop it
+            self._remove(path)
+            return None
+
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        return value
+
+    def put(self, key, value):
+        """ Stores value under key. Values which can not be pickled are not
+        stored.
+
+        """
+
+        try:
+            data = zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL), 1)
+        except (pickle.PicklingError, RuntimeError, TypeError):
+            # RuntimeError is raised for trees nested deeper than the
+            # recursion limit
+            return
+
+        path = self.path(key)
+        shard = os.path.dirname(path)
+
+        try:
+            os.makedirs(shard)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        # Write to a temporary file first so that concurrent readers never see
+        # a partially written entry
+        fd, temp_path = tempfile.mkstemp(dir=shard, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            if six.PY2 and os.path.exists(path):
+                os.remove(path)
+                os.rename(temp_path, path)
+            else:
+                os.replace(temp_path, path)
+        except Exception:
+            self._remove(temp_path)
+            raise
+
+        if self.max_size is not None:
+            if self.size is None:
+                self.size = sum(size for _, size, _ in self.entries())
+            else:
+                self.size += len(data)
+
+            if self.size > self.max_size:
+                self.evict()
+
+    def entries(self):
+        """ Yields (last use, size, path) for every entry in the cache. """
+
+        if not os.path.isdir(self.directory):
+            return
+
+        for shard in os.listdir(self.directory):
+            shard_path = os.path.join(self.directory, shard)
+
+            if len(shard) != 2 or not os.path.isdir(shard_path):
+                continue
+
+            for name in os.listdir(shard_path):
+                if name.startswith('.tmp'):
+                    continue
+
+                path = os.path.join(shard_path, name)
+
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+
+                yield stat.st_mtime, stat.st_size, path
+
+    def evict(self):
+        """ Removes the least recently used entries until the entries fit in
+        max_size.
+
+        """
+
+        entries = sorted(self.entries())
+        self.size = sum(size for _, size, _ in entries)
+
+        for _, size, path in entries:
+            if self.size <= self.max_size:
+                break
+
+            self._remove(path)
+            self.size -= size
+
+    def clear(self):
+        for _, _, path in list(self.entries()):
+            self._remove(path)
+        self.size = 0
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def token_stream(self, code, engine='default', lazy_positions=False,
+                     javadoc_mode='text', encoding=None):
+        """ Returns tokenizer.token_stream(code, ...), reading it from the
+        cache if the same source has been tokenized with the same options
+        before.
+
+        """
+
+        key = self.key(code, 'tokens', engine,
+                       'lazy' if lazy_positions else 'eager', javadoc_mode,
+                       encoding or '')
+        stream = self.get(key)
+
+        if stream is not None:
+            self.hits += 1
+            return stream
+
+        self.misses += 1
+        stream = token_stream(code, engine, lazy_positions,
+                              javadoc_mode=javadoc_mode, encoding=encoding)
+        self.put(key, stream)
+        return stream
+
+    def tokenize(self, code, engine='default', lazy_positions=False,
+                 javadoc_mode='text', encoding=None):
+        return list(self.token_stream(code, engine, lazy_positions,
+                                      javadoc_mode, encoding))
+
+    def parse(self, code, javadoc_mode='text', encoding=None):
+        """ Returns parse.parse(code), reading the tree from the cache if the
+        same source has been parsed before.
+
+        """
+
+        key = self.key(code, 'tree', javadoc_mode, encoding or '')
+        tree = self.get(key)
+
+        if tree is not None:
+            self.hits += 1
+            return tree
+
+        self.misses += 1
+        tokens = token_stream(code, javadoc_mode=javadoc_mode,
+                              encoding=encoding)
+        tree = Parser(tokens).parse()
+        self.put(key, tree)
+        return tree
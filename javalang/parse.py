@@ -47,7 +47,9 @@ def parse_type_signature(sig):
 
     return parser.parse_class_or_interface_declaration()
 
-def parse(s):
-    tokens = tokenize(s)
-    parser = Parser(tokens)
+def parse(s, intern_table=None, javadoc_mode='text', encoding=None,
+          memo_size=None, max_depth=None):
+    tokens = tokenize(s, intern_table=intern_table, javadoc_mode=javadoc_mode,
+                      encoding=encoding)
+    parser = Parser(tokens, intern_table, memo_size, max_depth)
     return parser.parse()
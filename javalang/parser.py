@@ -1,10 +1,13 @@
+import collections
+import functools
+
 import six
 
 from . import util
 from . import tree
 from .tokenizer import (
-    EndOfInput, Keyword, Modifier, BasicType, Identifier,
-    Annotation, Literal, Operator, JavaToken,
+    EndOfInput, Modifier, BasicType, Identifier, Annotation, Literal,
+    Operator,
     )
 
 ENABLE_DEBUG_SUPPORT = False
@@ -13,7 +16,7 @@ def parse_debug(method):
     global ENABLE_DEBUG_SUPPORT
 
     if ENABLE_DEBUG_SUPPORT:
-        def _method(self):
+        def _method(self, *args):
             if not hasattr(self, 'recursion_depth'):
                 self.recursion_depth = 0
 
@@ -30,7 +33,7 @@ def parse_debug(method):
                 self.recursion_depth += 1
 
                 try:
-                    r = method(self)
+                    r = method(self, *args)
 
                 except JavaSyntaxError as e:
                     e_message = e.description
@@ -48,7 +51,7 @@ def parse_debug(method):
             else:
                 self.recursion_depth += 1
                 try:
-                    r = method(self)
+                    r = method(self, *args)
                 finally:
                     self.recursion_depth -= 1
 
@@ -59,6 +62,81 @@ def parse_debug(method):
     else:
         return method
 
+def parse_memoized(method):
+    """ Packrat memoization of a rule which is parsed again at the same
+    token after a speculative parse failed. If the parser has a memo the
+    outcome of the rule at each token index, a node or a JavaSyntaxError, is
+    stored together with the index the rule stopped at, and replayed when
+    the rule is parsed at that index again.
+
+    Callers may modify the nodes they are given, so the memo holds a copy of
+    each node and every hit returns a fresh one (see _copy_node).
+
+    """
+
+    name = method.__name__
+
+    @functools.wraps(method)
+    def _method(self):
+        memo = self.memo
+
+        if memo is None:
+            return method(self)
+
+        tokens = self.tokens
+        key = (name, tokens.marker)
+        entry = memo.get(key)
+
+        if entry is not None:
+            self.memo_hits += 1
+            result, tokens.marker = entry
+
+            if isinstance(result, JavaSyntaxError):
+                raise result
+
+            return _copy_node(result)
+
+        self.memo_misses += 1
+
+        if len(memo) >= self.memo_size:
+            # Rules are rarely parsed again far behind the current token, so
+            # the oldest entries go first
+            memo.popitem(False)
+
+        try:
+            result = method(self)
+        except JavaSyntaxError as e:
+            memo[key] = (e, tokens.marker)
+            raise
+
+        memo[key] = (_copy_node(result), tokens.marker)
+        return result
+
+    return _method
+
+try:
+    _RecursionError = RecursionError
+except NameError:
+    # Python 2 raises RuntimeError when the recursion limit is reached
+    _RecursionError = RuntimeError
+
+def _copy_node(node):
+    """ Returns a copy of node with copies of its list attributes, which is
+    enough for callers extending or replacing the attributes of the node.
+    Nodes below it are shared, as the parse which produced them first has
+    been abandoned whenever they are handed out again.
+
+    """
+
+    copy = node.__class__.__new__(node.__class__)
+    copy.__dict__ = attrs = node.__dict__.copy()
+
+    for attr, value in attrs.items():
+        if isinstance(value, list):
+            attrs[attr] = list(value)
+
+    return copy
+
 # ------------------------------------------------------------------------------
 # ---- Parsing exception ----
 
@@ -91,10 +169,42 @@ class Parser(object):
                             set(('+', '-')),
                             set(('*', '/', '%')) ]
 
-    def __init__(self, tokens):
+    operator_levels = dict((operator, level)
+                           for level, operators in enumerate(operator_precedence)
+                           for operator in operators)
+
+    # Values of the tokens other than identifiers and basic types which may
+    # appear in a type
+    type_punctuation = frozenset(('.', '<', '>', ',', '?', 'extends', 'super',
+                                  '[', ']'))
+
+    # Values of the tokens which may start a primary besides literals,
+    # identifiers and basic types
+    primary_start_values = frozenset(('(', 'this', 'super', 'new', '<',
+                                      'void'))
+
+    def __init__(self, tokens, intern_table=None, memo_size=None,
+                 max_depth=None):
         self.tokens = util.LookAheadListIterator(tokens)
         self.tokens.set_default(EndOfInput(None))
 
+        # Accepted values and joined names are shared through intern_table if
+        # one is given (see util.InternTable)
+        self.intern_table = intern_table
+
+        # If memo_size is given the outcomes of up to that many rules marked
+        # with parse_memoized are kept (see parse_memoized)
+        self.memo_size = memo_size
+        self.memo = collections.OrderedDict() if memo_size else None
+        self.memo_hits = 0
+        self.memo_misses = 0
+
+        # Blocks, statements, class bodies, array initializers and expressions
+        # may be nested at most max_depth deep if it is given (see
+        # enter_nested)
+        self.max_depth = max_depth
+        self.depth = 0
+
         self.debug = False
 
 # ------------------------------------------------------------------------------
@@ -118,6 +228,28 @@ class Parser(object):
 
         raise JavaSyntaxError(description, at)
 
+    def enter_nested(self):
+        """ Counts a rule which may contain itself, such as a block or an
+        expression in parentheses, towards the nesting depth of the parser.
+        The rule restores depth when it is complete.
+
+        Rules which are still parsed recursively also catch the error raised
+        if the input is nested so deeply that the recursion limit of the
+        interpreter is reached first, and raise a JavaSyntaxError instead
+        (see recursion_exceeded). The innermost rules may not even have room
+        to do so, so it is raised by the first one which does.
+
+        """
+
+        if self.max_depth is not None and self.depth >= self.max_depth:
+            self.illegal("Maximum nesting depth of %d exceeded" % (self.max_depth,))
+
+        self.depth += 1
+
+    def recursion_exceeded(self, depth):
+        self.depth = depth
+        self.illegal("Nesting exceeds the recursion limit")
+
     def accept(self, *accepts):
         last = None
 
@@ -125,28 +257,34 @@ class Parser(object):
             raise JavaParserError("Missing acceptable values")
 
         for accept in accepts:
-            token = next(self.tokens)
+            value = self.tokens.look_value()
+            token_type = self.tokens.look_type()
+            self.tokens.skip()
+
             if isinstance(accept, six.string_types) and (
-                    not token.value == accept):
+                    not value == accept):
                 self.illegal("Expected '%s'" % (accept,))
-            elif isinstance(accept, type) and not isinstance(token, accept):
+            elif isinstance(accept, type) and not (
+                    token_type.KIND_MASK & accept.KIND_BIT):
                 self.illegal("Expected %s" % (accept.__name__,))
 
-            last = token
+            last = value
+
+        if self.intern_table is not None:
+            return self.intern_table.intern(last)
 
-        return last.value
+        return last
 
     def would_accept(self, *accepts):
         if len(accepts) == 0:
             raise JavaParserError("Missing acceptable values")
 
         for i, accept in enumerate(accepts):
-            token = self.tokens.look(i)
-
             if isinstance(accept, six.string_types) and (
-                    not token.value == accept):
+                    not self.tokens.look_value(i) == accept):
                 return False
-            elif isinstance(accept, type) and not isinstance(token, accept):
+            elif isinstance(accept, type) and not (
+                    self.tokens.look_type(i).KIND_MASK & accept.KIND_BIT):
                 return False
 
         return True
@@ -156,52 +294,54 @@ class Parser(object):
             raise JavaParserError("Missing acceptable values")
 
         for i, accept in enumerate(accepts):
-            token = self.tokens.look(i)
-
             if isinstance(accept, six.string_types) and (
-                    not token.value == accept):
+                    not self.tokens.look_value(i) == accept):
                 return False
-            elif isinstance(accept, type) and not isinstance(token, accept):
+            elif isinstance(accept, type) and not (
+                    self.tokens.look_type(i).KIND_MASK & accept.KIND_BIT):
                 return False
 
-        for i in range(0, len(accepts)):
-            next(self.tokens)
+        self.tokens.skip(len(accepts))
 
         return True
 
-    def build_binary_operation(self, parts, start_level=0):
+    def build_binary_operation(self, parts):
+        """ Builds the left associative tree of binary operations for parts,
+        which alternates operands and operators, in a single pass.
+
+        """
+
         if len(parts) == 1:
             return parts[0]
 
-        operands = list()
+        operator_levels = self.operator_levels
+        operands = [parts[0]]
         operators = list()
 
-        i = 0
+        for j in range(1, len(parts), 2):
+            level = operator_levels[parts[j]]
 
-        for level in range(start_level, len(self.operator_precedence)):
-            for j in range(1, len(parts) - 1, 2):
-                if parts[j] in self.operator_precedence[level]:
-                    operand = self.build_binary_operation(parts[i:j], level + 1)
-                    operator = parts[j]
-                    i = j + 1
+            # Everything on the stack which binds at least as tightly is
+            # complete, so reduce it before pushing the new operator
+            while operators and operator_levels[operators[-1]] >= level:
+                self.reduce_binary_operation(operands, operators)
 
-                    operands.append(operand)
-                    operators.append(operator)
+            operators.append(parts[j])
+            operands.append(parts[j + 1])
 
-            if operands:
-                break
+        while operators:
+            self.reduce_binary_operation(operands, operators)
 
-        operand = self.build_binary_operation(parts[i:], level + 1)
-        operands.append(operand)
+        return operands[0]
 
-        operation = operands[0]
+    def reduce_binary_operation(self, operands, operators):
+        operandr = operands.pop()
 
-        for operator, operandr in zip(operators, operands[1:]):
-            operation = tree.BinaryOperation(operandl=operation)
-            operation.operator = operator
-            operation.operandr = operandr
+        operation = tree.BinaryOperation(operandl=operands.pop())
+        operation.operator = operators.pop()
+        operation.operandr = operandr
 
-        return operation
+        operands.append(operation)
 
     def is_annotation(self, i=0):
         """ Returns true if the position is the start of an annotation application
@@ -209,8 +349,8 @@ class Parser(object):
 
         """
 
-        return (isinstance(self.tokens.look(i), Annotation)
-                and not self.tokens.look(i + 1).value == 'interface')
+        return (bool(self.tokens.look_type(i).KIND_MASK & Annotation.KIND_BIT)
+                and not self.tokens.look_value(i + 1) == 'interface')
 
     def is_annotation_declaration(self, i=0):
         """ Returns true if the position is the start of an annotation application
@@ -218,8 +358,18 @@ class Parser(object):
 
         """
 
-        return (isinstance(self.tokens.look(i), Annotation)
-                and self.tokens.look(i + 1).value == 'interface')
+        return (bool(self.tokens.look_type(i).KIND_MASK & Annotation.KIND_BIT)
+                and self.tokens.look_value(i + 1) == 'interface')
+
+    def join_name(self, identifiers):
+        """ Returns the qualified name made of identifiers """
+
+        name = '.'.join(identifiers)
+
+        if self.intern_table is not None:
+            return self.intern_table.intern(name)
+
+        return name
 
 # ------------------------------------------------------------------------------
 # ---- Parsing methods ----
@@ -242,7 +392,7 @@ class Parser(object):
             if not self.try_accept('.'):
                 break
 
-        return '.'.join(qualified_identifier)
+        return self.join_name(qualified_identifier)
 
     @parse_debug
     def parse_qualified_identifier_list(self):
@@ -271,7 +421,7 @@ class Parser(object):
         self.tokens.push_marker()
         next_token = self.tokens.look()
         if next_token:
-            javadoc = next_token.javadoc
+            javadoc = next_token.raw_javadoc
 
         if self.is_annotation():
             package_annotations = self.parse_annotations()
@@ -297,7 +447,7 @@ class Parser(object):
             import_declaration._position = token.position
             import_declarations.append(import_declaration)
 
-        while not isinstance(self.tokens.look(), EndOfInput):
+        while not self.tokens.look_type().KIND_MASK & EndOfInput.KIND_BIT:
             try:
                 type_declaration = self.parse_type_declaration()
             except StopIteration:
@@ -335,7 +485,7 @@ class Parser(object):
                 self.accept(';')
                 break
 
-        return tree.Import(path='.'.join(qualified_identifier),
+        return tree.Import(path=self.join_name(qualified_identifier),
                            static=static,
                            wildcard=import_all)
 
@@ -457,12 +607,15 @@ class Parser(object):
 # -- Types --
 
     @parse_debug
+    @parse_memoized
     def parse_type(self):
         java_type = None
 
-        if isinstance(self.tokens.look(), BasicType):
+        kind_mask = self.tokens.look_type().KIND_MASK
+
+        if kind_mask & BasicType.KIND_BIT:
             java_type = self.parse_basic_type()
-        elif isinstance(self.tokens.look(), Identifier):
+        elif kind_mask & Identifier.KIND_BIT:
             java_type = self.parse_reference_type()
         else:
             self.illegal("Expected type")
@@ -633,7 +786,7 @@ class Parser(object):
 
         next_token = self.tokens.look()
         if next_token:
-            javadoc = next_token.javadoc
+            javadoc = next_token.raw_javadoc
 
         while True:
             token = self.tokens.look()
@@ -761,15 +914,29 @@ class Parser(object):
     @parse_debug
     def parse_class_body(self):
         declarations = list()
+        depth = self.depth
 
-        self.accept('{')
+        try:
+            self.enter_nested()
+            self.accept('{')
 
-        while not self.would_accept('}'):
-            declaration = self.parse_class_body_declaration()
-            if declaration:
-                declarations.append(declaration)
+            while not self.would_accept('}'):
+                # Members skip parse_class_body_declaration, which would add
+                # a frame for every nested class
+                if self.tokens.look_value() in (';', '{') or (
+                        self.would_accept('static', '{')):
+                    declaration = self.parse_class_body_declaration()
+                else:
+                    declaration = self.parse_member_declaration()
 
-        self.accept('}')
+                if declaration:
+                    declarations.append(declaration)
+
+            self.accept('}')
+        except _RecursionError:
+            self.recursion_exceeded(depth)
+        finally:
+            self.depth = depth
 
         return declarations
 
@@ -1240,94 +1407,207 @@ class Parser(object):
 
     @parse_debug
     def parse_array_initializer(self):
-        array_initializer = tree.ArrayInitializer(initializers=list())
+        """ Parses an array initializer and the array initializers nested in
+        it. Like nested statements (see parse_nested_statements), nested
+        initializers are kept on a stack instead of being parsed recursively.
 
+        """
+
+        depth = self.depth
+        frames = list()
+
+        try:
+            initializer = self.start_array_initializer(frames)
+
+            while True:
+                if initializer is None:
+                    if self.would_accept('{'):
+                        initializer = self.start_array_initializer(frames)
+                        continue
+
+                    initializer = self.parse_expression()
+
+                if not frames:
+                    return initializer
+
+                frames[-1].initializers.append(initializer)
+                initializer = None
+
+                if not self.would_accept('}'):
+                    self.accept(',')
+
+                if self.try_accept('}'):
+                    initializer = self.pop_frame(frames)
+        finally:
+            self.depth = depth
+
+    def start_array_initializer(self, frames):
+        self.push_frame(frames, tree.ArrayInitializer(initializers=list()))
         self.accept('{')
 
         if self.try_accept(','):
             self.accept('}')
-            return array_initializer
+            return self.pop_frame(frames)
 
         if self.try_accept('}'):
-            return array_initializer
-
-        while True:
-            initializer = self.parse_variable_initializer()
-            array_initializer.initializers.append(initializer)
-
-            if not self.would_accept('}'):
-                self.accept(',')
-
-            if self.try_accept('}'):
-                return array_initializer
+            return self.pop_frame(frames)
 
 # ------------------------------------------------------------------------------
 # -- Blocks and statements --
 
     @parse_debug
     def parse_block(self):
-        statements = list()
-
-        self.accept('{')
-
-        while not self.would_accept('}'):
-            statement = self.parse_block_statement()
-            statements.append(statement)
-        self.accept('}')
+        block = self.parse_nested_statements(self.start_block)
 
-        return statements
+        return block.statements
 
     @parse_debug
     def parse_block_statement(self):
-        if self.would_accept(Identifier, ':'):
-            # Labeled statement
-            return self.parse_statement()
+        return self.parse_nested_statements(self.start_block_statement)
+
+    @parse_debug
+    def parse_statement(self):
+        return self.parse_nested_statements(self.start_statement)
 
-        if self.would_accept('synchronized'):
-            return self.parse_statement()
+    def parse_nested_statements(self, start):
+        """ Parses a statement, starting with start(frames), and the
+        statements nested in it.
+
+        Statements which contain statements are not parsed recursively. The
+        start methods only parse the head of such a statement, such as 'if
+        (condition)' or '{', and push its node on frames. The statements
+        inside are then given to the node on top of frames by
+        complete_statement until the node is complete, so the nesting is
+        bounded by max_depth rather than by the interpreter's stack. Labels
+        are pushed as their identifier.
+
+        """
+
+        depth = self.depth
+        frames = list()
+
+        try:
+            statement = start(frames)
+
+            while True:
+                while statement is None:
+                    if isinstance(frames[-1], tree.BlockStatement):
+                        if self.try_accept('}'):
+                            statement = self.pop_frame(frames)
+                        else:
+                            statement = self.start_block_statement(frames)
+                    else:
+                        statement = self.start_statement(frames)
+
+                if not frames:
+                    return statement
+
+                statement = self.complete_statement(frames, statement)
+        finally:
+            self.depth = depth
+
+    def push_frame(self, frames, node):
+        self.enter_nested()
+        frames.append(node)
+
+    def pop_frame(self, frames):
+        self.depth -= 1
+        return frames.pop()
+
+    def complete_statement(self, frames, statement):
+        """ Gives statement to the node on top of frames and returns the node
+        if it is complete, or None if it contains more statements.
+
+        """
+
+        frame = frames[-1]
+
+        if isinstance(frame, tree.BlockStatement):
+            frame.statements.append(statement)
+            return None
+
+        elif isinstance(frame, tree.IfStatement):
+            if frame.then_statement is None:
+                frame.then_statement = statement
+
+                if self.try_accept('else'):
+                    return None
+            else:
+                frame.else_statement = statement
+
+        elif isinstance(frame, (tree.WhileStatement, tree.ForStatement)):
+            frame.body = statement
+
+        elif isinstance(frame, tree.DoStatement):
+            frame.body = statement
+            self.accept('while')
+            frame.condition = self.parse_par_expression()
+            self.accept(';')
+
+        elif isinstance(frame, tree.SynchronizedStatement):
+            frame.block = statement.statements
+
+        else:
+            self.pop_frame(frames)
+            statement.label = frame
+            return statement
+
+        return self.pop_frame(frames)
+
+    def start_block(self, frames):
+        self.accept('{')
+        self.push_frame(frames, tree.BlockStatement(statements=list()))
+
+    def start_block_statement(self, frames):
+        token = self.tokens.look()
+        start = self.statement_starts.get(token.value)
+
+        if start is not None:
+            return start(self, frames)
 
-        token = None
         found_annotations = False
         i = 0
 
-        # Look past annoatations and modifiers. If we find a modifier that is not
-        # 'final' then the statement must be a class or interface declaration
-        while True:
-            token = self.tokens.look(i)
+        if token.KIND_MASK & (Modifier.KIND_BIT | Annotation.KIND_BIT):
+            # Look past annoatations and modifiers. If we find a modifier that is
+            # not 'final' then the statement must be a class or interface
+            # declaration
+            while True:
+                token = self.tokens.look(i)
 
-            if isinstance(token, Modifier):
-                if not token.value == 'final':
-                    return self.parse_class_or_interface_declaration()
+                if token.KIND_MASK & Modifier.KIND_BIT:
+                    if not token.value == 'final':
+                        return self.parse_class_or_interface_declaration()
 
-            elif self.is_annotation(i):
-                found_annotations = True
+                elif self.is_annotation(i):
+                    found_annotations = True
 
-                i += 2
-                while self.tokens.look(i).value == '.':
                     i += 2
+                    while self.tokens.look(i).value == '.':
+                        i += 2
 
-                if self.tokens.look(i).value == '(':
-                    parens = 1
-                    i += 1
-
-                    while parens > 0:
-                        token = self.tokens.look(i)
-                        if token.value == '(':
-                            parens += 1
-                        elif token.value == ')':
-                            parens -= 1
+                    if self.tokens.look(i).value == '(':
+                        parens = 1
                         i += 1
-                    continue
 
-            else:
-                break
+                        while parens > 0:
+                            token = self.tokens.look(i)
+                            if token.value == '(':
+                                parens += 1
+                            elif token.value == ')':
+                                parens -= 1
+                            i += 1
+                        continue
 
-            i += 1
+                else:
+                    break
+
+                i += 1
 
         if token.value in ('class', 'enum', 'interface', '@'):
             return self.parse_class_or_interface_declaration()
 
-        if found_annotations or isinstance(token, BasicType):
+        if found_annotations or token.KIND_MASK & BasicType.KIND_BIT:
             statement = self.parse_local_variable_declaration_statement()
             statement._position = token.position
             return statement
@@ -1335,8 +1615,12 @@ class Parser(object):
         # At this point, if the block statement is a variable definition the next
         # token MUST be an identifier, so if it isn't we can conclude the block
         # statement is a normal statement
-        if not isinstance(token, Identifier):
-            return self.parse_statement()
+        if not token.KIND_MASK & Identifier.KIND_BIT:
+            return self.start_statement(frames)
+
+        if self.would_accept(Identifier, ':'):
+            # Labeled statement
+            return self.start_statement(frames)
 
         # We can't easily determine the statement type. Try parsing as a variable
         # declaration first and fall back to a statement
@@ -1346,7 +1630,7 @@ class Parser(object):
                 statement._position = token.position
                 return statement
         except JavaSyntaxError:
-            return self.parse_statement()
+            return self.start_statement(frames)
 
     @parse_debug
     def parse_local_variable_declaration_statement(self):
@@ -1361,166 +1645,181 @@ class Parser(object):
                                             declarators=declarators)
         return var
 
-    @parse_debug
-    def parse_statement(self):
-        token = self.tokens.look()
-        if self.would_accept('{'):
-            block = self.parse_block()
-            return tree.BlockStatement(statements=block)
+    def start_statement(self, frames):
+        """ Parses a statement and returns it, or parses the head of a
+        statement which contains statements, pushes its node on frames and
+        returns None (see parse_nested_statements).
+
+        """
 
-        elif self.try_accept(';'):
-            return tree.Statement()
+        start = self.statement_starts.get(self.tokens.look_value())
+
+        if start is not None:
+            return start(self, frames)
 
         elif self.would_accept(Identifier, ':'):
             identifer = self.parse_identifier()
             self.accept(':')
 
-            statement = self.parse_statement()
-            statement.label = identifer
-
-            return statement
-
-        elif self.try_accept('if'):
-            condition = self.parse_par_expression()
-            then = self.parse_statement()
-            else_statement = None
+            self.push_frame(frames, identifer)
 
-            if self.try_accept('else'):
-                else_statement = self.parse_statement()
-
-            return tree.IfStatement(condition=condition,
-                                    then_statement=then,
-                                    else_statement=else_statement)
+        else:
+            expression = self.parse_expression()
+            self.accept(';')
 
-        elif self.try_accept('assert'):
-            condition = self.parse_expression()
-            value = None
+            return tree.StatementExpression(expression=expression)
 
-            if self.try_accept(':'):
-                value = self.parse_expression()
+    def start_empty_statement(self, frames):
+        self.accept(';')
+        return tree.Statement()
 
-            self.accept(';')
+    def start_if_statement(self, frames):
+        self.accept('if')
+        condition = self.parse_par_expression()
 
-            return tree.AssertStatement(condition=condition,
-                                        value=value)
+        self.push_frame(frames, tree.IfStatement(condition=condition))
 
-        elif self.try_accept('switch'):
-            switch_expression = self.parse_par_expression()
-            self.accept('{')
-            switch_block = self.parse_switch_block_statement_groups()
-            self.accept('}')
+    def start_assert_statement(self, frames):
+        self.accept('assert')
+        condition = self.parse_expression()
+        value = None
 
-            return tree.SwitchStatement(expression=switch_expression,
-                                        cases=switch_block)
+        if self.try_accept(':'):
+            value = self.parse_expression()
 
-        elif self.try_accept('while'):
-            condition = self.parse_par_expression()
-            action = self.parse_statement()
+        self.accept(';')
 
-            return tree.WhileStatement(condition=condition,
-                                       body=action)
+        return tree.AssertStatement(condition=condition,
+                                    value=value)
 
-        elif self.try_accept('do'):
-            action = self.parse_statement()
-            self.accept('while')
-            condition = self.parse_par_expression()
-            self.accept(';')
+    def start_switch_statement(self, frames):
+        self.accept('switch')
+        switch_expression = self.parse_par_expression()
+        self.accept('{')
+        switch_block = self.parse_switch_block_statement_groups()
+        self.accept('}')
 
-            return tree.DoStatement(condition=condition,
-                                    body=action)
+        return tree.SwitchStatement(expression=switch_expression,
+                                    cases=switch_block)
 
-        elif self.try_accept('for'):
-            self.accept('(')
-            for_control = self.parse_for_control()
-            self.accept(')')
-            for_statement = self.parse_statement()
+    def start_while_statement(self, frames):
+        self.accept('while')
+        condition = self.parse_par_expression()
 
-            return tree.ForStatement(control=for_control,
-                                     body=for_statement)
+        self.push_frame(frames, tree.WhileStatement(condition=condition))
 
-        elif self.try_accept('break'):
-            label = None
+    def start_do_statement(self, frames):
+        self.accept('do')
+        self.push_frame(frames, tree.DoStatement())
 
-            if self.would_accept(Identifier):
-                label = self.parse_identifier()
+    def start_for_statement(self, frames):
+        self.accept('for', '(')
+        for_control = self.parse_for_control()
+        self.accept(')')
 
-            self.accept(';')
+        self.push_frame(frames, tree.ForStatement(control=for_control))
 
-            return tree.BreakStatement(goto=label)
+    def start_break_statement(self, frames):
+        self.accept('break')
+        label = None
 
-        elif self.try_accept('continue'):
-            label = None
+        if self.would_accept(Identifier):
+            label = self.parse_identifier()
 
-            if self.would_accept(Identifier):
-                label = self.parse_identifier()
+        self.accept(';')
 
-            self.accept(';')
+        return tree.BreakStatement(goto=label)
 
-            return tree.ContinueStatement(goto=label)
+    def start_continue_statement(self, frames):
+        self.accept('continue')
+        label = None
 
-        elif self.try_accept('return'):
-            value = None
+        if self.would_accept(Identifier):
+            label = self.parse_identifier()
 
-            if not self.would_accept(';'):
-                value = self.parse_expression()
+        self.accept(';')
 
-            self.accept(';')
+        return tree.ContinueStatement(goto=label)
 
-            statement = tree.ReturnStatement(expression=value)
-            statement._position = token.position
-            return statement
+    def start_return_statement(self, frames):
+        token = self.tokens.next()
+        value = None
 
-        elif self.try_accept('throw'):
+        if not self.would_accept(';'):
             value = self.parse_expression()
-            self.accept(';')
-
-            return tree.ThrowStatement(expression=value)
 
-        elif self.try_accept('synchronized'):
-            lock = self.parse_par_expression()
-            block = self.parse_block()
+        self.accept(';')
 
-            return tree.SynchronizedStatement(lock=lock,
-                                              block=block)
+        statement = tree.ReturnStatement(expression=value)
+        statement._position = token.position
+        return statement
 
-        elif self.try_accept('try'):
-            resource_specification = None
-            block = None
-            catches = None
-            finally_block = None
+    def start_throw_statement(self, frames):
+        self.accept('throw')
+        value = self.parse_expression()
+        self.accept(';')
 
-            if self.would_accept('{'):
-                block = self.parse_block()
+        return tree.ThrowStatement(expression=value)
 
-                if self.would_accept('catch'):
-                    catches = self.parse_catches()
+    def start_synchronized_statement(self, frames):
+        self.accept('synchronized')
+        lock = self.parse_par_expression()
 
-                if self.try_accept('finally'):
-                    finally_block = self.parse_block()
+        self.push_frame(frames, tree.SynchronizedStatement(lock=lock))
+        self.start_block(frames)
 
-                if catches == None and finally_block == None:
-                    self.illegal("Expected catch/finally block")
+    def start_try_statement(self, frames):
+        self.accept('try')
+        resource_specification = None
+        block = None
+        catches = None
+        finally_block = None
 
-            else:
-                resource_specification = self.parse_resource_specification()
-                block = self.parse_block()
+        if self.would_accept('{'):
+            block = self.parse_block()
 
-                if self.would_accept('catch'):
-                    catches = self.parse_catches()
+            if self.would_accept('catch'):
+                catches = self.parse_catches()
 
-                if self.try_accept('finally'):
-                    finally_block = self.parse_block()
+            if self.try_accept('finally'):
+                finally_block = self.parse_block()
 
-            return tree.TryStatement(resources=resource_specification,
-                                     block=block,
-                                     catches=catches,
-                                     finally_block=finally_block)
+            if catches == None and finally_block == None:
+                self.illegal("Expected catch/finally block")
 
         else:
-            expression = self.parse_expression()
-            self.accept(';')
+            resource_specification = self.parse_resource_specification()
+            block = self.parse_block()
 
-            return tree.StatementExpression(expression=expression)
+            if self.would_accept('catch'):
+                catches = self.parse_catches()
+
+            if self.try_accept('finally'):
+                finally_block = self.parse_block()
+
+        return tree.TryStatement(resources=resource_specification,
+                                 block=block,
+                                 catches=catches,
+                                 finally_block=finally_block)
+
+    # Maps the value of the first token of a statement to the method starting
+    # it, other than labeled statements and expressions (see start_statement)
+    statement_starts = {
+        '{': start_block,
+        ';': start_empty_statement,
+        'if': start_if_statement,
+        'assert': start_assert_statement,
+        'switch': start_switch_statement,
+        'while': start_while_statement,
+        'do': start_do_statement,
+        'for': start_for_statement,
+        'break': start_break_statement,
+        'continue': start_continue_statement,
+        'return': start_return_statement,
+        'throw': start_throw_statement,
+        'synchronized': start_synchronized_statement,
+        'try': start_try_statement,
+    }
 
 # ------------------------------------------------------------------------------
 # -- Try / catch --
@@ -1748,51 +2047,107 @@ class Parser(object):
 # -- Expressions --
 
     @parse_debug
-    def parse_expression(self):
-        expressionl = self.parse_expressionl()
-        assignment_type = None
-        assignment_expression = None
+    def parse_expression(self, assignment=True):
+        """ Parses an expression, or only a conditional expression if
+        assignment is False (see parse_expressionl).
 
-        if self.tokens.look().value in Operator.ASSIGNMENT:
-            assignment_type = self.tokens.next().value
-            assignment_expression = self.parse_expression()
-            return tree.Assignment(expressionl=expressionl,
-                                   type=assignment_type,
-                                   value=assignment_expression)
-        else:
-            return expressionl
+        The parentheses an expression starts with are counted rather than
+        parsed recursively, so '((((a))))' is bounded by max_depth instead of
+        the interpreter's stack: the expression inside them is parsed first,
+        and each ')' then hands it to parse_expression_3 as the primary of
+        the expression around it. Conditional expressions are parsed here
+        rather than by a rule of their own to keep other nested expressions,
+        such as arguments and array indices, one frame shallower.
+
+        """
+
+        depth = self.depth
+        parentheses = 0
+        primary = None
+
+        try:
+            # The element values of annotations are not nested in other
+            # expressions, so only their parentheses count towards the depth
+            if assignment:
+                self.enter_nested()
+
+            while self.tokens.look_value() == '(' and (
+                    self.scan_parenthesized() is None):
+                self.accept('(')
+                self.enter_nested()
+                parentheses += 1
+
+            while True:
+                assignments = list()
+
+                # Assignments associate to the right like ternary
+                # expressions, so both are collected first and built from the
+                # end instead of being parsed recursively
+                while True:
+                    expression_2 = self.parse_expression_2(primary)
+                    primary = None
+                    branches = list()
+
+                    while self.try_accept('?'):
+                        true_expression = self.parse_expression()
+                        self.accept(':')
+
+                        branches.append((expression_2, true_expression))
+                        expression_2 = self.parse_expression_2()
+
+                    expression = expression_2
+
+                    if self.would_accept('->'):
+                        body = self.parse_lambda_method_body()
+                        expression = tree.LambdaExpression(
+                            parameters=[expression_2],
+                            body=body)
+                    elif self.try_accept('::'):
+                        method_reference, type_arguments = self.parse_method_reference()
+                        expression = tree.MethodReference(
+                            expression=expression_2,
+                            method=method_reference,
+                            type_arguments=type_arguments)
+
+                    for condition, true_expression in reversed(branches):
+                        expression = tree.TernaryExpression(
+                            condition=condition,
+                            if_true=true_expression,
+                            if_false=expression)
+
+                    if not (assignment or parentheses) or (
+                            self.tokens.look_value() not in Operator.ASSIGNMENT):
+                        break
+
+                    assignment_type = self.tokens.next().value
+                    assignments.append((expression, assignment_type))
+
+                for assignment_target, assignment_type in reversed(assignments):
+                    expression = tree.Assignment(expressionl=assignment_target,
+                                                 type=assignment_type,
+                                                 value=expression)
+
+                if parentheses == 0:
+                    return expression
+
+                self.accept(')')
+                self.depth -= 1
+                parentheses -= 1
+                primary = expression
+        except _RecursionError:
+            self.recursion_exceeded(depth)
+        finally:
+            self.depth = depth
 
     @parse_debug
     def parse_expressionl(self):
-        expression_2 = self.parse_expression_2()
-        true_expression = None
-        false_expression = None
-
-        if self.try_accept('?'):
-            true_expression = self.parse_expression()
-            self.accept(':')
-            false_expression = self.parse_expressionl()
-
-            return tree.TernaryExpression(condition=expression_2,
-                                          if_true=true_expression,
-                                          if_false=false_expression)
-        if self.would_accept('->'):
-            body = self.parse_lambda_method_body()
-            return tree.LambdaExpression(parameters=[expression_2],
-                                         body=body)
-        if self.try_accept('::'):
-            method_reference, type_arguments = self.parse_method_reference()
-            return tree.MethodReference(
-                expression=expression_2,
-                method=method_reference,
-                type_arguments=type_arguments)
-        return expression_2
+        return self.parse_expression(False)
 
     @parse_debug
-    def parse_expression_2(self):
-        expression_3 = self.parse_expression_3()
-        token = self.tokens.look()
-        if token.value in Operator.INFIX or token.value == 'instanceof':
+    def parse_expression_2(self, primary=None):
+        expression_3 = self.parse_expression_3(primary)
+        value = self.tokens.look_value()
+        if value in Operator.INFIX or value == 'instanceof':
             parts = self.parse_expression_2_rest()
             parts.insert(0, expression_3)
             return self.build_binary_operation(parts)
@@ -1803,8 +2158,8 @@ class Parser(object):
     def parse_expression_2_rest(self):
         parts = list()
 
-        token = self.tokens.look()
-        while token.value in Operator.INFIX or token.value == 'instanceof':
+        value = self.tokens.look_value()
+        while value in Operator.INFIX or value == 'instanceof':
             if self.try_accept('instanceof'):
                 comparison_type = self.parse_type()
                 parts.extend(('instanceof', comparison_type))
@@ -1813,7 +2168,7 @@ class Parser(object):
                 expression = self.parse_expression_3()
                 parts.extend((operator, expression))
 
-            token = self.tokens.look()
+            value = self.tokens.look_value()
 
         return parts
 
@@ -1821,50 +2176,156 @@ class Parser(object):
 # -- Expression operators --
 
     @parse_debug
-    def parse_expression_3(self):
+    def parse_expression_3(self, primary=None):
         prefix_operators = list()
-        while self.tokens.look().value in Operator.PREFIX:
-            prefix_operators.append(self.tokens.next().value)
 
-        if self.would_accept('('):
-            try:
-                with self.tokens:
-                        lambda_exp = self.parse_lambda_expression()
-                        if lambda_exp:
-                            return lambda_exp
-            except JavaSyntaxError:
-                pass
-            try:
-                with self.tokens:
-                    self.accept('(')
-                    cast_target = self.parse_type()
-                    self.accept(')')
-                    expression = self.parse_expression_3()
-
-                    return tree.Cast(type=cast_target,
-                                     expression=expression)
-            except JavaSyntaxError:
-                pass
+        # parse_expression gives the expressions it parsed in parentheses as
+        # the primary
+        if primary is None:
+            while self.tokens.look_value() in Operator.PREFIX:
+                prefix_operators.append(self.tokens.next().value)
+
+            if self.would_accept('('):
+                construct = self.scan_parenthesized()
+
+                # The scan rules out every construct the tokens can not form,
+                # so the speculative parses below only fail on unusual input
+                # such as '(a) < b'
+                if construct == 'lambda':
+                    try:
+                        with self.tokens:
+                            return self.parse_lambda_expression()
+                    except JavaSyntaxError:
+                        pass
+
+                elif construct == 'cast':
+                    try:
+                        with self.tokens:
+                            self.accept('(')
+                            cast_target = self.parse_type()
+                            self.accept(')')
+                            expression = self.parse_expression_3()
+
+                            return tree.Cast(type=cast_target,
+                                             expression=expression)
+                    except JavaSyntaxError:
+                        pass
+
+            primary = self.parse_primary()
 
-        primary = self.parse_primary()
         primary.prefix_operators = prefix_operators
         primary.selectors = list()
         primary.postfix_operators = list()
 
-        token = self.tokens.look()
-        while token.value in '[.':
+        value = self.tokens.look_value()
+        while value in '[.':
+            position = self.tokens.look_position()
             selector = self.parse_selector()
-            selector._position = token.position
+            selector._position = position
             primary.selectors.append(selector)
 
-            token = self.tokens.look()
+            value = self.tokens.look_value()
 
-        while token.value in Operator.POSTFIX:
-            primary.postfix_operators.append(self.tokens.next().value)
-            token = self.tokens.look()
+        while value in Operator.POSTFIX:
+            primary.postfix_operators.append(self.accept(Operator))
+            value = self.tokens.look_value()
 
         return primary
 
+    def scan_parenthesized(self):
+        """ Looks at the tokens following the '(' at the current position
+        and returns 'lambda' if they may be the parameters of a lambda
+        expression, 'cast' if they may be a cast and None if they can only
+        start a parenthesized expression.
+
+        Scanning stops at the first token which can appear in neither
+        parameters nor a type, so nested parentheses are not scanned again
+        at every level.
+
+        """
+
+        look_value = self.tokens.look_value
+        look_type = self.tokens.look_type
+
+        type_bits = Identifier.KIND_BIT | BasicType.KIND_BIT
+        may_be_type = type_bits & look_type(1).KIND_MASK
+        angles = 0
+        value = None
+        i = 1
+
+        while True:
+            last = value
+            value = look_value(i)
+            kind_mask = look_type(i).KIND_MASK
+
+            if value == ')':
+                break
+
+            elif kind_mask & type_bits:
+                pass
+
+            elif value in self.type_punctuation:
+                if value == '<':
+                    angles += 1
+                elif value == '>':
+                    angles -= 1
+                elif value == '[' and look_value(i + 1) != ']':
+                    return None
+
+            elif value == '...' or value == 'final':
+                may_be_type = False
+
+            elif kind_mask & Annotation.KIND_BIT:
+                may_be_type = False
+
+                # Skip the name and the arguments of the annotation
+                i += 1
+                while look_value(i + 1) == '.':
+                    i += 2
+
+                if look_value(i + 1) == '(':
+                    depth = 0
+
+                    while True:
+                        i += 1
+                        value = look_value(i)
+
+                        if value == '(':
+                            depth += 1
+                        elif value == ')':
+                            depth -= 1
+
+                            if depth == 0:
+                                break
+                        elif look_type(i).KIND_MASK & EndOfInput.KIND_BIT:
+                            return None
+
+            else:
+                return None
+
+            i += 1
+
+        following = i + 1
+
+        if look_value(following) == '->':
+            if i == 2 and look_type(1).KIND_MASK & Identifier.KIND_BIT:
+                # '(a) -> ...' is parsed as a parenthesized expression
+                # followed by a lambda body (see parse_expression)
+                return None
+            return 'lambda'
+
+        if not may_be_type or angles != 0 or last in self.type_punctuation and (
+                last != '>' and last != ']'):
+            return None
+
+        if (look_value(following) in Operator.PREFIX or
+                look_value(following) in self.primary_start_values or
+                look_type(following).KIND_MASK & (
+                    type_bits | Literal.KIND_BIT)):
+            return 'cast'
+
+        return None
+
     @parse_debug
     def parse_method_reference(self):
         type_arguments = list()
@@ -1922,14 +2383,18 @@ class Parser(object):
 
     @parse_debug
     def parse_primary(self):
-        token = self.tokens.look()
+        value = self.tokens.look_value()
+        token_type = self.tokens.look_type()
+        position = self.tokens.look_position()
+
+        kind_mask = token_type.KIND_MASK
 
-        if isinstance(token, Literal):
+        if kind_mask & Literal.KIND_BIT:
             literal = self.parse_literal()
-            literal._position = token.position
+            literal._position = position
             return literal
 
-        elif token.value == '(':
+        elif value == '(':
             return self.parse_par_expression()
 
         elif self.try_accept('this'):
@@ -1942,7 +2407,7 @@ class Parser(object):
             return tree.This()
         elif self.would_accept('super', '::'):
             self.accept('super')
-            return token
+            return tree.SuperMemberReference()
         elif self.try_accept('super'):
             super_suffix = self.parse_super_suffix()
             return super_suffix
@@ -1950,7 +2415,7 @@ class Parser(object):
         elif self.try_accept('new'):
             return self.parse_creator()
 
-        elif token.value == '<':
+        elif value == '<':
             type_arguments = self.parse_nonwildcard_type_arguments()
 
             if self.try_accept('this'):
@@ -1959,12 +2424,12 @@ class Parser(object):
                                                           arguments=arguments)
             else:
                 invocation = self.parse_explicit_generic_invocation_suffix()
-                invocation._position = token.position
+                invocation._position = position
                 invocation.type_arguments = type_arguments
 
                 return invocation
 
-        elif isinstance(token, Identifier):
+        elif kind_mask & Identifier.KIND_BIT:
             qualified_identifier = [self.parse_identifier()]
 
             while self.would_accept('.', Identifier):
@@ -1972,7 +2437,13 @@ class Parser(object):
                 identifier = self.parse_identifier()
                 qualified_identifier.append(identifier)
 
-            identifier_suffix = self.parse_identifier_suffix()
+            # Invocations, the common case of parse_identifier_suffix, are
+            # handled here so nested arguments take one frame less
+            if self.would_accept('('):
+                arguments = self.parse_arguments()
+                identifier_suffix = tree.MethodInvocation(arguments=arguments)
+            else:
+                identifier_suffix = self.parse_identifier_suffix()
 
             if isinstance(identifier_suffix, (tree.MemberReference, tree.MethodInvocation)):
                 # Take the last identifer as the member and leave the rest for the qualifier
@@ -1981,12 +2452,12 @@ class Parser(object):
             elif isinstance(identifier_suffix, tree.ClassReference):
                 identifier_suffix.type = tree.ReferenceType(name=qualified_identifier.pop())
 
-            identifier_suffix._position = token.position
-            identifier_suffix.qualifier = '.'.join(qualified_identifier)
+            identifier_suffix._position = position
+            identifier_suffix.qualifier = self.join_name(qualified_identifier)
 
             return identifier_suffix
 
-        elif isinstance(token, BasicType):
+        elif kind_mask & BasicType.KIND_BIT:
             base_type = self.parse_basic_type()
             base_type.dimensions = self.parse_array_dimension()
             self.accept('.', 'class')
@@ -2230,8 +2701,7 @@ class Parser(object):
 
         elif self.try_accept('.'):
 
-            token = self.tokens.look()
-            if isinstance(token, Identifier):
+            if self.tokens.look_type().KIND_MASK & Identifier.KIND_BIT:
                 identifier = self.tokens.next().value
                 arguments = None
 
@@ -2244,7 +2714,7 @@ class Parser(object):
                     return tree.MemberReference(member=identifier)
             elif self.would_accept('super', '::'):
                 self.accept('super')
-                return token
+                return tree.SuperMemberReference()
             elif self.would_accept('<'):
                 return self.parse_explicit_generic_invocation()
             elif self.try_accept('this'):
@@ -2304,7 +2774,7 @@ class Parser(object):
 
         next_token = self.tokens.look()
         if next_token:
-            javadoc = next_token.javadoc
+            javadoc = next_token.raw_javadoc
 
         if self.would_accept(Annotation):
             annotations = self.parse_annotations()
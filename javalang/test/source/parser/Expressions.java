@@ -0,0 +1,58 @@
+/**
+ * Expressions and statements which the parser can only tell apart by
+ * looking ahead: lambdas, casts and parenthesized expressions.
+ */
+package org.javalang.test;
+
+import java.util.*;
+import java.util.function.*;
+import java.util.stream.*;
+
+public class Expressions<T extends Comparable<T>> {
+    private final Map<String, List<Integer>> index = new HashMap<>();
+
+    public List<String> names(List<Person> people) {
+        return people.stream()
+            .filter(p -> p.getAge() > 18 && (p.getName() != null))
+            .map((Person p) -> p.getName().toUpperCase())
+            .sorted((a, b) -> a.compareTo(b))
+            .collect(Collectors.toList());
+    }
+
+    public int sum(int[] values) {
+        int total = 0;
+        for (int i = 0; i < values.length; i++) {
+            total += (int) ((long) values[i] * (values[i] + 1) / 2);
+        }
+        for (final int v : values) {
+            total -= (v % 3 == 0) ? (v / 3) : ((v + 1) * 2);
+        }
+        return total;
+    }
+
+    public Object cast(Object o) {
+        String s = (String) o;
+        List<String> l = (List<String>) (Object) s;
+        Function<Integer, Integer> f = x -> (x + 1) * (x - 1);
+        BiFunction<Integer, Integer, Integer> g = (x, y) -> ((x) + (y));
+        Supplier<Map<String, List<Integer>>> m = () -> new HashMap<>();
+        Runnable r = () -> { System.out.println((Object) ("a" + (1 + 2))); };
+        int[] a = new int[] { (1), ((2)), (((3))) };
+        double d = (double) a[0] / (a.length > 0 ? (double) a.length : 1.0);
+        return ((Comparable<T>) o).compareTo((T) (Object) l) > 0 ? (Object) f : g;
+    }
+
+    public void statements(List<String> items) {
+        Map<String, Integer> counts = new TreeMap<>();
+        for (String item : items) {
+            counts.merge(item, 1, Integer::sum);
+        }
+        items.forEach(item -> { if (item.isEmpty()) { return; } index.put(item, new ArrayList<>()); });
+        int x = 0, y = (x + 1), z = ((x) * (y));
+        x = (y) - (z);
+        x = (int) +y;
+        label: while (x < 10) { x++; if (x == 5) break label; }
+        switch (x) { case 1: x = (x); break; default: x = -(x); }
+        try { x = Integer.parseInt((String) (Object) "1"); } catch (NumberFormatException e) { x = 0; } finally { x++; }
+    }
+}
@@ -0,0 +1,42 @@
+/**
+ * Exercises the lexical grammar: comments, literals, operators, separators
+ * and identifiers.
+ */
+package org.javalang.test;
+
+import java.util.*;
+
+// A line comment
+@SuppressWarnings({"unchecked", "rawtypes"})
+public abstract class Tokens<T extends Comparable<? super T>> implements Runnable {
+
+    /** Field documentation */
+    private static final long MAX = 0x7fff_ffffL, MIN = -0b1010_1010L;
+    protected int octal = 0777, zero = 0, big = 1_000_000;
+    double d1 = 1.5e-3, d2 = .25, d3 = 10., d4 = 1e10d, d5 = 3f;
+    double hex = 0x1.8p1, hex2 = 0XAP-2f;
+    char c1 = 'a', c2 = '\n', c3 = '\'', c4 = 'A', c5 = '\377';
+    String s = "tab\there \"quoted\" \\ back", empty = "";
+    String café = "naïve", 名前 = "値";
+    int $dollar_ = 1, _under = 2;
+
+    /* a block
+       comment spanning lines */
+    @Override
+    public void run() {
+        int x = 1 + 2 - 3 * 4 / 5 % 6;
+        x += 1; x -= 1; x *= 2; x /= 2; x %= 3;
+        x <<= 1; x >>= 1; x >>>= 1; x &= 1; x |= 1; x ^= 1;
+        boolean b = x < 1 || x > 2 && x <= 3 | x >= 4 & x == 5 ^ x != 6;
+        b = !b; x = ~x; x++; --x;
+        int y = x >> 2 >>> 3 << 4;
+        java.util.function.Function<String, Integer> f = String::length;
+        Runnable r = () -> { };
+        Object o = b ? null : Boolean.TRUE;
+        if (o instanceof String) { return; }
+        List<List<String>> nested = new ArrayList<>();
+        varargs("a", "b");
+    }
+
+    abstract void varargs(String... args);/**/int tail;
+}
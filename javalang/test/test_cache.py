@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pkg_resources import resource_string
+from .. import parse, tokenizer
+from ..cache import SourceCache
+from .test_tokenizer import describe, dump_tree
+
+
+class TestSourceCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.code = resource_string(
+            __name__, 'source/tokenizer/Tokens.java').decode('utf-8')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parse(self):
+        expected = dump_tree(parse.parse(self.code))
+
+        cache = SourceCache(self.directory)
+        self.assertEqual(dump_tree(cache.parse(self.code)), expected)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+        # A new cache over the same directory, as in a later run
+        cache = SourceCache(self.directory)
+        self.assertEqual(dump_tree(cache.parse(self.code)), expected)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+    def test_token_stream(self):
+        expected = describe(tokenizer.tokenize(self.code))
+
+        cache = SourceCache(self.directory)
+        cache.token_stream(self.code)
+        self.assertEqual(describe(cache.token_stream(self.code)), expected)
+        self.assertEqual(describe(cache.tokenize(self.code)), expected)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+        # Entries are kept apart by their options and by the source
+        cache.token_stream(self.code, engine='regex')
+        cache.token_stream(self.code, lazy_positions=True)
+        cache.token_stream(self.code + ' ')
+        self.assertEqual(cache.misses, 4)
+
+    def test_sharding(self):
+        cache = SourceCache(self.directory)
+        cache.parse(self.code)
+
+        key = cache.key(self.code, 'tree', 'text', '')
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.directory, key[:2], key[2:])))
+
+    def test_damaged_entry(self):
+        cache = SourceCache(self.directory)
+        cache.parse(self.code)
+
+        path = cache.path(cache.key(self.code, 'tree', 'text', ''))
+        with open(path, 'wb') as f:
+            f.write(b'not an entry')
+
+        cache.parse(self.code)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+        cache.parse(self.code)
+        self.assertEqual(cache.hits, 1)
+
+    def test_eviction(self):
+        cache = SourceCache(self.directory)
+        sources = ['class A%d { int x = %d; }' % (i, i) for i in range(4)]
+
+        for i, source in enumerate(sources):
+            cache.parse(source)
+            path = cache.path(cache.key(source, 'tree', 'text', ''))
+            os.utime(path, (1000 + i, 1000 + i))
+
+        # Reading the first entry makes it the most recently used
+        cache.parse(sources[0])
+
+        sizes = [size for _, size, _ in cache.entries()]
+        cache.max_size = sum(sizes) - min(sizes)
+        cache.evict()
+
+        remaining = set(path for _, _, path in cache.entries())
+        expected = set(cache.path(cache.key(source, 'tree', 'text', ''))
+                       for source in sources[0:1] + sources[2:])
+        self.assertEqual(remaining, expected)
+        self.assertTrue(cache.size <= cache.max_size)
+
+    def test_errors_are_not_cached(self):
+        cache = SourceCache(self.directory)
+
+        for _ in range(2):
+            with self.assertRaises(tokenizer.LexerError):
+                cache.parse('class A { char c = \'; }')
+
+        self.assertEqual(list(cache.entries()), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
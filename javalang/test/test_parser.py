@@ -0,0 +1,408 @@
+import unittest
+
+from pkg_resources import resource_string
+from .. import parse, parser, tokenizer, tree
+from .test_tokenizer import dump_tree
+
+
+class TestMemoization(unittest.TestCase):
+    def setUp(self):
+        self.code = resource_string(__name__, 'source/parser/Expressions.java')
+        self.expected = dump_tree(parse.parse(self.code))
+
+    def test_same_tree(self):
+        for memo_size in (1, 8, 4096):
+            p = parser.Parser(tokenizer.tokenize(self.code), memo_size=memo_size)
+
+            self.assertEqual(dump_tree(p.parse()), self.expected)
+            self.assertTrue(len(p.memo) <= memo_size)
+
+        self.assertTrue(p.memo_misses > 0)
+
+    def test_disabled(self):
+        p = parser.Parser(tokenizer.tokenize(self.code))
+        p.parse()
+
+        self.assertEqual((p.memo, p.memo_hits, p.memo_misses), (None, 0, 0))
+
+    def test_hits_return_copies(self):
+        p = parser.Parser(tokenizer.tokenize('int x'), memo_size=4)
+
+        try:
+            with p.tokens:
+                java_type = p.parse_type()
+                java_type.dimensions += [None]
+                p.illegal('Abandoned')
+        except parser.JavaSyntaxError:
+            pass
+
+        java_type = p.parse_type()
+
+        self.assertEqual(java_type.dimensions, [])
+        self.assertEqual(p.tokens.look().value, 'x')
+        self.assertEqual((p.memo_hits, p.memo_misses), (1, 1))
+
+    def test_failures_replayed(self):
+        p = parser.Parser(tokenizer.tokenize('( x'), memo_size=4)
+
+        for _ in range(2):
+            with self.assertRaises(parser.JavaSyntaxError):
+                with p.tokens:
+                    p.parse_type()
+
+        self.assertEqual((p.memo_hits, p.memo_misses), (1, 1))
+        self.assertEqual(p.tokens.look().value, '(')
+
+
+class TestParenthesized(unittest.TestCase):
+    def scan(self, code):
+        return parser.Parser(tokenizer.tokenize(code)).scan_parenthesized()
+
+    def expression(self, code):
+        p = parser.Parser(tokenizer.tokenize(code))
+        expression = p.parse_expression()
+
+        self.assertEqual(p.tokens.look().value, ';')
+        return expression
+
+    def test_scan(self):
+        cases = [
+            ('(x, y) -> x;', 'lambda'),
+            ('() -> 1;', 'lambda'),
+            ('(int x) -> x;', 'lambda'),
+            ('(final A x, @N(v = (1)) B y) -> x;', 'lambda'),
+            ('(String... s) -> s;', 'lambda'),
+            ('(String) o;', 'cast'),
+            ('(int[]) o;', 'cast'),
+            ('(Map<String, List<Integer>>) o;', 'cast'),
+            ('(List<? extends T>) (Object) o;', 'cast'),
+            ('(int) -x;', 'cast'),
+            ('(a) + b;', 'cast'),
+            ('(a) -> a;', None),
+            ('(a) * b;', None),
+            ('(a.b());', None),
+            ('(a < b);', None),
+            ('(a[0]) + 1;', None),
+            ('(1 + 2);', None),
+        ]
+
+        for code, construct in cases:
+            self.assertEqual(self.scan(code), construct, code)
+
+    def test_trees(self):
+        cases = [
+            ('(x, y) -> x + y;', 'LambdaExpression'),
+            ('(String) o;', 'Cast'),
+            ('(Comparable<T>) (Object) o;', 'Cast'),
+            ('(int) +y;', 'Cast'),
+            ('(a) + b;', 'Cast'),
+            ('(a < b);', 'BinaryOperation'),
+            ('(x) * (y);', 'BinaryOperation'),
+        ]
+
+        for code, node in cases:
+            self.assertEqual(type(self.expression(code)).__name__, node, code)
+
+    def test_fallback(self):
+        # '(a) < b' scans as a possible cast but is a comparison
+        expression = self.expression('(a) < b;')
+        self.assertEqual(type(expression).__name__, 'BinaryOperation')
+        self.assertEqual(expression.operator, '<')
+
+
+class TestBinaryOperation(unittest.TestCase):
+    def shape(self, node):
+        if isinstance(node, tree.BinaryOperation):
+            return (self.shape(node.operandl), node.operator,
+                    self.shape(node.operandr))
+        return node.member
+
+    def expression(self, code):
+        return parser.Parser(tokenizer.tokenize(code + ';')).parse_expression()
+
+    def test_precedence(self):
+        cases = [
+            ('a + b + c', (('a', '+', 'b'), '+', 'c')),
+            ('a - b * c / d', ('a', '-', (('b', '*', 'c'), '/', 'd'))),
+            ('a * b + c * d', (('a', '*', 'b'), '+', ('c', '*', 'd'))),
+            ('a || b && c | d ^ e & f', ('a', '||', ('b', '&&', ('c', '|',
+                                         ('d', '^', ('e', '&', 'f')))))),
+            ('a == b < c << d + e', ('a', '==', ('b', '<', ('c', '<<',
+                                     ('d', '+', 'e'))))),
+            ('a + b >> c > d != e', (((('a', '+', 'b'), '>>', 'c'), '>', 'd'),
+                                     '!=', 'e')),
+        ]
+
+        for code, shape in cases:
+            self.assertEqual(self.shape(self.expression(code)), shape, code)
+
+    def test_instanceof(self):
+        expression = self.expression('a + b instanceof C && d')
+
+        self.assertEqual(expression.operator, '&&')
+        self.assertEqual(expression.operandl.operator, 'instanceof')
+        self.assertEqual(self.shape(expression.operandl.operandl),
+                         ('a', '+', 'b'))
+        self.assertEqual(expression.operandl.operandr.name, 'C')
+
+    def test_long_chain(self):
+        count = 5000
+        code = ' + '.join('x%d' % i for i in range(count))
+        expression = self.expression(code)
+
+        for i in reversed(range(1, count)):
+            self.assertEqual(expression.operator, '+')
+            self.assertEqual(expression.operandr.member, 'x%d' % i)
+            expression = expression.operandl
+
+        self.assertEqual(expression.member, 'x0')
+
+
+class TestMethodReferences(unittest.TestCase):
+    def references(self, code):
+        compilation_unit = parse.parse('class A { void m() { %s } }' % (code,))
+        return [node for _, node in compilation_unit.filter(tree.MethodReference)]
+
+    def test_super(self):
+        # The 'super' primary is a SuperMemberReference node rather than the
+        # raw token, which can not take the Primary attributes
+        reference, qualified = self.references('f(super::foo, A.super::bar);')
+
+        self.assertTrue(isinstance(reference.expression,
+                                   tree.SuperMemberReference))
+        self.assertEqual(reference.expression.member, None)
+        self.assertEqual(reference.expression.selectors, [])
+        self.assertEqual(reference.method.member, 'foo')
+
+        self.assertEqual(qualified.expression.member, 'A')
+        self.assertEqual([type(selector) for selector in
+                          qualified.expression.selectors],
+                         [tree.SuperMemberReference])
+        self.assertEqual(qualified.method.member, 'bar')
+
+
+class TestStatements(unittest.TestCase):
+    def parse(self, method, code):
+        p = parser.Parser(tokenizer.tokenize(code))
+        statement = getattr(p, method)()
+
+        self.assertEqual(type(p.tokens.look()).__name__, 'EndOfInput')
+        return statement
+
+    def test_statements(self):
+        cases = [
+            ('{ x(); }', 'BlockStatement'),
+            (';', 'Statement'),
+            ('if (a) x();', 'IfStatement'),
+            ('assert a : b;', 'AssertStatement'),
+            ('switch (a) { case 1: break; }', 'SwitchStatement'),
+            ('while (a) x();', 'WhileStatement'),
+            ('do x(); while (a);', 'DoStatement'),
+            ('for (;;) x();', 'ForStatement'),
+            ('break L;', 'BreakStatement'),
+            ('continue;', 'ContinueStatement'),
+            ('return a;', 'ReturnStatement'),
+            ('throw e;', 'ThrowStatement'),
+            ('synchronized (a) { x(); }', 'SynchronizedStatement'),
+            ('try { x(); } finally { y(); }', 'TryStatement'),
+            ('L: x();', 'StatementExpression'),
+            ('a = b;', 'StatementExpression'),
+        ]
+
+        for code, node in cases:
+            for method in ('parse_statement', 'parse_block_statement'):
+                statement = self.parse(method, code)
+                self.assertEqual(type(statement).__name__, node, code)
+
+    def test_block_statements(self):
+        cases = [
+            ('int x = 1;', 'LocalVariableDeclaration'),
+            ('final List<T> x;', 'LocalVariableDeclaration'),
+            ('@A(b = (1)) x y;', 'LocalVariableDeclaration'),
+            ('a.B<C> d;', 'LocalVariableDeclaration'),
+            ('class C { }', 'ClassDeclaration'),
+            ('abstract class C { }', 'ClassDeclaration'),
+            ('@A static class C { }', 'ClassDeclaration'),
+            ('enum E { F }', 'EnumDeclaration'),
+            ('a.b();', 'StatementExpression'),
+            ('this.a = b;', 'StatementExpression'),
+        ]
+
+        for code, node in cases:
+            statement = self.parse('parse_block_statement', code)
+            self.assertEqual(type(statement).__name__, node, code)
+
+    def test_positions(self):
+        statements = parse.parse(
+            'class A {\n  void m() {\n    int x;\n    return x;\n  }\n}\n'
+            ).types[0].body[0].body
+
+        self.assertEqual([tuple(statement.position) for statement in statements],
+                         [(3, 5), (4, 5)])
+
+
+class TestNesting(unittest.TestCase):
+    def method_body(self, body, max_depth=None):
+        code = 'class A { void m() { %s } }' % (body,)
+        compilation_unit = parse.parse(code, max_depth=max_depth)
+
+        return compilation_unit.types[0].body[0].body
+
+    def test_blocks(self):
+        count = 2000
+        statements = self.method_body('{ ' * count + 'x();' + ' }' * count)
+
+        for _ in range(count):
+            self.assertEqual(len(statements), 1)
+            self.assertTrue(isinstance(statements[0], tree.BlockStatement))
+            statements = statements[0].statements
+
+        self.assertTrue(isinstance(statements[0], tree.StatementExpression))
+
+    def test_else_if_chain(self):
+        count = 2000
+        body = 'if (c0) x(); ' + ' '.join(
+            'else if (c%d) x();' % i for i in range(1, count)) + ' else y();'
+        statement = self.method_body(body)[0]
+
+        for i in range(count):
+            self.assertEqual(statement.condition.member, 'c%d' % i)
+            statement = statement.else_statement
+
+        self.assertEqual(statement.expression.member, 'y')
+
+    def test_statements(self):
+        body = ('L: while (a) for (;;) do synchronized (b) { if (c) ; '
+                'else { return; } } while (d);')
+        statement = self.method_body(body)[0]
+
+        self.assertEqual(statement.label, 'L')
+        self.assertTrue(isinstance(statement, tree.WhileStatement))
+        statement = statement.body
+        self.assertTrue(isinstance(statement, tree.ForStatement))
+        statement = statement.body
+        self.assertTrue(isinstance(statement, tree.DoStatement))
+        self.assertEqual(statement.condition.member, 'd')
+        statement = statement.body
+        self.assertTrue(isinstance(statement, tree.SynchronizedStatement))
+        statement = statement.block[0]
+        self.assertTrue(isinstance(statement, tree.IfStatement))
+        self.assertTrue(isinstance(statement.else_statement.statements[0],
+                                   tree.ReturnStatement))
+
+    def test_ternary_and_assignment_chains(self):
+        count = 2000
+        body = ' = '.join('a%d' % i for i in range(count)) + ' = ' + ' : '.join(
+            'c%d ? t%d' % (i, i) for i in range(count)) + ' : f;'
+        expression = self.method_body(body)[0].expression
+
+        for i in range(count):
+            self.assertEqual(expression.expressionl.member, 'a%d' % i)
+            expression = expression.value
+
+        for i in range(count):
+            self.assertEqual(expression.condition.member, 'c%d' % i)
+            self.assertEqual(expression.if_true.member, 't%d' % i)
+            expression = expression.if_false
+
+        self.assertEqual(expression.member, 'f')
+
+    def test_max_depth(self):
+        body = '{ ' * 20 + 'x = (((y)));' + ' }' * 20
+
+        self.method_body(body, max_depth=30)
+
+        for max_depth in (5, 25):
+            with self.assertRaises(parser.JavaSyntaxError) as context:
+                self.method_body(body, max_depth=max_depth)
+
+            self.assertEqual(context.exception.description,
+                             'Maximum nesting depth of %d exceeded' % max_depth)
+
+    def field_initializer(self, initializer):
+        code = 'class A { Object a = %s; }' % (initializer,)
+        compilation_unit = parse.parse(code)
+
+        return compilation_unit.types[0].body[0].declarators[0].initializer
+
+    def test_array_initializers(self):
+        count = 2000
+        initializer = self.field_initializer('{' * count + 'x' + '}' * count)
+
+        for _ in range(count):
+            self.assertTrue(isinstance(initializer, tree.ArrayInitializer))
+            self.assertEqual(len(initializer.initializers), 1)
+            initializer = initializer.initializers[0]
+
+        self.assertEqual(initializer.member, 'x')
+
+    def test_parentheses(self):
+        count = 2000
+        expression = self.field_initializer(
+            '(' * count + 'x' + ' + y)' * count)
+
+        for _ in range(count):
+            self.assertEqual(expression.operator, '+')
+            self.assertEqual(expression.operandr.member, 'y')
+            expression = expression.operandl
+
+        self.assertEqual(expression.member, 'x')
+
+        statement = self.method_body('(' * count + 'x' + ')' * count + ' = y;')[0]
+        self.assertEqual(statement.expression.expressionl.member, 'x')
+
+    # Class bodies, invocations, array indices and lambda bodies are still
+    # parsed recursively, so these are only deeper than the recursion limit
+    # allowed before they were counted without a frame of their own
+
+    def test_class_bodies(self):
+        count = 280
+        code = 'class A { ' + 'class B { ' * count + '}' * count + ' }'
+        declaration = parse.parse(code).types[0]
+
+        for _ in range(count):
+            declaration = declaration.body[0]
+
+        self.assertEqual(declaration.body, [])
+
+    def test_invocations(self):
+        count = 160
+        expression = self.field_initializer('f(' * count + ')' * count)
+
+        for _ in range(count - 1):
+            expression = expression.arguments[0]
+
+        self.assertEqual(expression.arguments, [])
+
+    def test_array_indices(self):
+        count = 210
+        expression = self.field_initializer('a[' * count + '0' + ']' * count)
+
+        for _ in range(count):
+            expression = expression.selectors[0].index
+
+        self.assertEqual(expression.value, '0')
+
+    def test_lambda_bodies(self):
+        count = 360
+        expression = self.field_initializer('a -> ' * count + 'x')
+
+        for _ in range(count):
+            expression = expression.body
+
+        self.assertEqual(expression.member, 'x')
+
+    def test_recursion_limit(self):
+        count = 5000
+        code = 'class A { Object a = ' + 'f(' * count + ')' * count + '; }'
+        p = parser.Parser(tokenizer.tokenize(code))
+
+        with self.assertRaises(parser.JavaSyntaxError) as context:
+            p.parse()
+
+        self.assertEqual(context.exception.description,
+                         'Nesting exceeds the recursion limit')
+        self.assertEqual(p.depth, 0)
+
+if __name__ == "__main__":
+    unittest.main()
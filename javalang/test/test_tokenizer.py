@@ -0,0 +1,806 @@
+import codecs
+import io
+import os
+import pickle
+import tempfile
+import unicodedata
+import unittest
+
+from pkg_resources import resource_string
+from .. import parse, parser, tokenizer, tree
+
+
+def describe(tokens):
+    return [(type(token).__name__, token.value, token.position, token.javadoc)
+            for token in tokens]
+
+
+class TestRegexEngine(unittest.TestCase):
+    """ Differential tests of the regex scanning engine against the default
+    engine.
+
+    """
+
+    def assert_engines_agree(self, code):
+        expected = describe(tokenizer.tokenize(code))
+        actual = describe(tokenizer.tokenize(code, engine='regex'))
+
+        self.assertEqual(expected, actual)
+
+    def test_source_file(self):
+        self.assert_engines_agree(
+            resource_string(__name__, 'source/tokenizer/Tokens.java'))
+
+    def test_package_info_files(self):
+        for name in ('AnnotationJavadoc', 'AnnotationOnly', 'JavadocAnnotation',
+                     'JavadocOnly', 'NoAnnotationNoJavadoc'):
+            self.assert_engines_agree(
+                resource_string(__name__, 'source/package-info/%s.java' % name))
+
+    def test_snippets(self):
+        snippets = [
+            'a..b...c.5 .e;',
+            '017.5 08.5 0_1 0x 0b 1e 1_000L;',
+            'x>>>=y>>=z>>>w>>v;',
+            'a/b/=c/**/d/*e*/f//g\n',
+            '/** doc */ class A {}\n/** unterminated',
+            'a // trailing comment without newline',
+            '\u00e9t\u00e9 = \u540d\u524d + x\u0301;',
+            'char c = \'\\u0041\'; String s = "\\u00e9";',
+            'int \\u0061 = 1;',
+            '5l.500 7Ld 73ele 02_l 0x1p 1e+ .5e-3f',
+        ]
+
+        for snippet in snippets:
+            self.assert_engines_agree(snippet)
+
+    def test_errors(self):
+        for code in ('"unterminated', '"bad \\q escape";', '#', '0x1.5;'):
+            self.assertRaises(tokenizer.LexerError,
+                              list, tokenizer.tokenize(code))
+            self.assertRaises(tokenizer.LexerError,
+                              list, tokenizer.tokenize(code, engine='regex'))
+
+    def test_unknown_engine(self):
+        self.assertRaises(ValueError, tokenizer.tokenize, '', engine='nope')
+
+
+class TestOperators(unittest.TestCase):
+    def test_all_operators(self):
+        operators = sorted(tokenizer.Operator.VALUES)
+        tokens = list(tokenizer.tokenize(' '.join(operators)))
+
+        self.assertEqual([token.value for token in tokens], operators)
+        self.assertTrue(all(isinstance(token, tokenizer.Operator)
+                            for token in tokens))
+
+    def test_maximal_munch(self):
+        tokens = list(tokenizer.tokenize('a>>>=b>>>c>>=d..e...f/=g'))
+
+        self.assertEqual([token.value for token in tokens],
+                         ['a', '>>>=', 'b', '>', '>', '>', 'c', '>>=', 'd',
+                          '.', '.', 'e', '...', 'f', '/=', 'g'])
+
+
+class TestNumbers(unittest.TestCase):
+    def assert_values(self, code, expected):
+        tokens = list(tokenizer.tokenize(code))
+
+        self.assertEqual([type(token) for token in tokens],
+                         [token_type for token_type, value in expected])
+        self.assertEqual([token.numeric_value() for token in tokens],
+                         [value for token_type, value in expected])
+
+    def test_integers(self):
+        self.assert_values(
+            '0 1_000 2147483648 9223372036854775807L 017 0b1010_1010 0xffL '
+            '0x7fff_ffff 0xffffffff 0xFFFFFFFFFFFFFFFFl 037777777777',
+            [(tokenizer.DecimalInteger, 0),
+             (tokenizer.DecimalInteger, 1000),
+             (tokenizer.DecimalInteger, 2147483648),
+             (tokenizer.DecimalInteger, 9223372036854775807),
+             (tokenizer.OctalInteger, 15),
+             (tokenizer.BinaryInteger, 170),
+             (tokenizer.HexInteger, 255),
+             (tokenizer.HexInteger, 2147483647),
+             (tokenizer.HexInteger, -1),
+             (tokenizer.HexInteger, -1),
+             (tokenizer.OctalInteger, -1)])
+
+    def test_floats(self):
+        self.assert_values(
+            '1.5 .25 10. 1e10d 3f 1_0.5e-1 0x1.8p1 0XAP-2f 0.1f',
+            [(tokenizer.DecimalFloatingPoint, 1.5),
+             (tokenizer.DecimalFloatingPoint, 0.25),
+             (tokenizer.DecimalFloatingPoint, 10.0),
+             (tokenizer.DecimalFloatingPoint, 1e10),
+             (tokenizer.DecimalFloatingPoint, 3.0),
+             (tokenizer.DecimalFloatingPoint, 1.05),
+             (tokenizer.HexFloatingPoint, 3.0),
+             (tokenizer.HexFloatingPoint, 2.5),
+             (tokenizer.DecimalFloatingPoint, 0.10000000149011612)])
+
+    def test_float_limits(self):
+        self.assert_values(
+            '3.4028235e38f 1.4e-45f 1.7976931348623157e308 4.9e-324 0x1p-1074 '
+            '0.0e10f 0x0.0p1',
+            [(tokenizer.DecimalFloatingPoint, 3.4028234663852886e38),
+             (tokenizer.DecimalFloatingPoint, 1.401298464324817e-45),
+             (tokenizer.DecimalFloatingPoint, 1.7976931348623157e308),
+             (tokenizer.DecimalFloatingPoint, 5e-324),
+             (tokenizer.HexFloatingPoint, 5e-324),
+             (tokenizer.DecimalFloatingPoint, 0.0),
+             (tokenizer.HexFloatingPoint, 0.0)])
+
+    def test_invalid_values(self):
+        for code in ('2147483649', '0x1_0000_0000', '1e', '"1"', 'true',
+                     '1e39f', '3.4028236e38f', '1e400', '0x1p200f', '0x1p2000',
+                     '1e-50f', '1e-400', '0x1p-1075', '0x0.ep-2000'):
+            token = list(tokenizer.tokenize(code))[0]
+            self.assertRaises(ValueError, token.numeric_value)
+
+    def test_invalid_hex_float(self):
+        for engine in tokenizer.JavaTokenizer.ENGINES:
+            self.assertRaises(tokenizer.LexerError, list,
+                              tokenizer.tokenize('0x1.8 + 1', engine))
+
+
+class TestStrings(unittest.TestCase):
+    def test_literals(self):
+        body = 'x' * 100000 + '\\\\ \\" \\\' \\n \\377 \\0a'
+        code = 'a = "%s" + \'\\\'\' + \'"\' + "\'";' % (body,)
+
+        for engine in tokenizer.JavaTokenizer.ENGINES:
+            tokens = list(tokenizer.tokenize(code, engine))
+
+            self.assertEqual([token.value for token in tokens[2::2]],
+                             ['"%s"' % (body,), "'\\''", '\'"\'', '"\'"'])
+            self.assertTrue(all(isinstance(token, tokenizer.String)
+                                for token in tokens[2::2]))
+
+    def assert_error(self, code, message):
+        for engine in tokenizer.JavaTokenizer.ENGINES:
+            try:
+                list(tokenizer.tokenize(code, engine))
+            except tokenizer.LexerError as e:
+                self.assertEqual(str(e), message, engine)
+            else:
+                self.fail('LexerError not raised')
+
+    def test_errors(self):
+        self.assert_error('a = "abc\\\\',
+                          'Unterminated character/string literal at " ", '
+                          'line 1: a = "abc\\')
+        self.assert_error('a = \'\\',
+                          'Unterminated character/string literal at " ", '
+                          'line 1: a = \'')
+        self.assert_error('a\n"x\\\\" + "\\q"',
+                          'Illegal escape character at "q", line 2: '
+                          '"x\\\\" + "\\q')
+        self.assert_error('x /** d */\'\\',
+                          'Unterminated character/string literal at "\'", '
+                          'line 1: x /** d */\'')
+
+
+class TestIdentifiers(unittest.TestCase):
+    def test_classification(self):
+        tokens = list(tokenizer.tokenize(
+            'class int public true null foo x\u00e9y \u540d\u524d_1'))
+
+        self.assertEqual([type(token) for token in tokens],
+                         [tokenizer.Keyword, tokenizer.BasicType,
+                          tokenizer.Modifier, tokenizer.Boolean,
+                          tokenizer.Null, tokenizer.Identifier,
+                          tokenizer.Identifier, tokenizer.Identifier])
+        self.assertEqual(tokens[-1].value, u'\u540d\u524d_1')
+
+    def test_unicode_tables(self):
+        tokenizer.JavaTokenizer.load_identifier_tables()
+
+        start = tokenizer.JavaTokenizer.ident_start_pattern
+        part = tokenizer.JavaTokenizer.ident_part_pattern
+
+        for c in u'a\u00e9\u540d\u0660\u0301\u20ac\u2028\u00bf':
+            category = unicodedata.category(c)
+
+            self.assertEqual(start.match(c) is not None,
+                             category in tokenizer.JavaTokenizer.IDENT_START_CATEGORIES)
+            self.assertEqual(part.match(c).end() == 1,
+                             category in tokenizer.JavaTokenizer.IDENT_PART_CATEGORIES)
+
+    def test_non_ascii_identifiers(self):
+        code = u'caf\u00e9 x\u0301y \u20acuro'
+        tokens = list(tokenizer.tokenize(code + u';'))
+
+        self.assertEqual([token.value for token in tokens[:3]],
+                         code.split()[:3])
+        self.assertRaises(tokenizer.LexerError, list,
+                          tokenizer.tokenize(u'\u00bf'))
+
+
+class TestJavaToken(unittest.TestCase):
+    def test_lazy_value_and_position(self):
+        token = tokenizer.Identifier.from_span(u'int foo;', 4, 7, 1, 4)
+
+        self.assertFalse(hasattr(token, '__dict__'))
+        self.assertEqual(token._value, None)
+        self.assertEqual(token.value, u'foo')
+        self.assertEqual(token.position, (1, 4))
+
+        token.value = u'bar'
+        self.assertEqual(token.value, u'bar')
+
+    def test_constructor(self):
+        token = tokenizer.Operator('+', (2, 3))
+
+        self.assertEqual(token.value, '+')
+        self.assertEqual(token.position, (2, 3))
+        self.assertTrue(token.is_infix())
+        self.assertEqual(tokenizer.EndOfInput(None).value, None)
+
+    def test_kind_masks(self):
+        token_types = [tokenizer.JavaToken] + tokenizer.TOKEN_TYPES
+
+        for kind, token_type in enumerate(tokenizer.TOKEN_TYPES):
+            self.assertEqual(token_type.KIND, kind)
+
+        for a in token_types:
+            for b in token_types:
+                self.assertEqual(bool(a.KIND_MASK & b.KIND_BIT),
+                                 issubclass(a, b))
+
+        token = tokenizer.Modifier('public')
+        self.assertTrue(token.KIND_MASK & tokenizer.Keyword.KIND_BIT)
+        self.assertFalse(token.KIND_MASK & tokenizer.BasicType.KIND_BIT)
+
+    def test_pickle(self):
+        token = list(tokenizer.tokenize('/** doc */ foo'))[0]
+        copy = pickle.loads(pickle.dumps(token))
+
+        self.assertEqual(describe([copy]), describe([token]))
+
+
+class TestPositions(unittest.TestCase):
+    def setUp(self):
+        self.code = resource_string(__name__, 'source/tokenizer/Tokens.java')
+
+    def test_columns(self):
+        # Columns count from the start of the data on the first line, from
+        # the newline before other lines and from the end of a comment on
+        # the line it ends on
+        code = 'a /* x */ b\n// c\n  d /** doc */ e\n  f'
+
+        for engine in tokenizer.JavaTokenizer.ENGINES:
+            for lazy_positions in (False, True):
+                tokens = tokenizer.tokenize(code, engine, lazy_positions)
+
+                self.assertEqual([token.position for token in tokens],
+                                 [(1, 0), (1, 1), (3, 2), (3, 1), (4, 3)])
+
+    def test_lazy_positions(self):
+        for engine in tokenizer.JavaTokenizer.ENGINES:
+            eager = tokenizer.tokenize(self.code, engine)
+            lazy = tokenizer.tokenize(self.code, engine, lazy_positions=True)
+
+            self.assertEqual(describe(eager), describe(lazy))
+
+        stream = tokenizer.token_stream(self.code, lazy_positions=True)
+
+        self.assertEqual(len(stream.lines), 0)
+        self.assertEqual(describe(stream), describe(tokenizer.tokenize(self.code)))
+
+    def test_end_position(self):
+        code = 'int x = "a\\nb";\n/** doc */\nfoo'
+
+        for lazy_positions in (False, True):
+            tokens = list(tokenizer.tokenize(code, lazy_positions=lazy_positions))
+
+            self.assertEqual(tokens[0].end_position, (1, 3))
+            self.assertEqual(tokens[3].end_position, (1, 14))
+            self.assertEqual(tokens[-1].end_position, (3, 4))
+
+    def test_lazy_error_line(self):
+        try:
+            list(tokenizer.tokenize('a\nb\n#', lazy_positions=True))
+        except tokenizer.LexerError as e:
+            self.assertTrue('line 3' in str(e))
+        else:
+            self.fail('LexerError not raised')
+
+
+class TestUnicodeEscapes(unittest.TestCase):
+    def test_data_without_escapes_is_not_copied(self):
+        code = u'int x = 1; // \\n'
+        javatokenizer = tokenizer.JavaTokenizer(code)
+        list(javatokenizer.tokenize())
+
+        self.assertTrue(javatokenizer.data is code)
+        self.assertEqual(javatokenizer.offset_map, None)
+
+    def test_translation(self):
+        code = u'int \\u0061 = "\\\\u0041" + "\\\\\\u0041" + \\uuu0062;'
+        tokens = list(tokenizer.tokenize(code))
+
+        self.assertEqual([token.value for token in tokens],
+                         [u'int', u'a', u'=', u'"\\\\u0041"', u'+',
+                          u'"\\\\A"', u'+', u'b', u';'])
+
+    def test_positions_refer_to_original_data(self):
+        code = u'x\\u000ay \\u0061\\u0062 c\n  \\u0064'
+
+        for engine in tokenizer.JavaTokenizer.ENGINES:
+            tokens = list(tokenizer.tokenize(code, engine))
+
+            self.assertEqual([token.value for token in tokens],
+                             [u'x', u'y', u'ab', u'c', u'd'])
+            self.assertEqual([token.position for token in tokens],
+                             [(1, 0), (1, 7), (1, 9), (1, 22), (2, 3)])
+            self.assertEqual(tokens[2].end_position, (1, 21))
+
+            streamed = tokenizer.tokenize_stream(io.StringIO(code),
+                                                 engine, chunk_size=3)
+            self.assertEqual(describe(streamed), describe(tokens))
+
+    def test_invalid_escape(self):
+        for code in (u'\\u00G1', u'x\\u12'):
+            self.assertRaises(tokenizer.LexerError,
+                              list, tokenizer.tokenize(code))
+
+
+class TestJavadocModes(unittest.TestCase):
+    def setUp(self):
+        self.code = resource_string(__name__, 'source/tokenizer/Tokens.java')
+
+    def test_span(self):
+        for engine in tokenizer.JavaTokenizer.ENGINES:
+            expected = describe(tokenizer.tokenize(self.code, engine))
+            tokens = list(tokenizer.tokenize(self.code, engine,
+                                             javadoc_mode='span'))
+
+            self.assertTrue(isinstance(tokens[0].raw_javadoc, tokenizer.JavadocSpan))
+            self.assertEqual(describe(tokens), expected)
+
+            stream = tokenizer.token_stream(self.code, engine, javadoc_mode='span')
+            self.assertEqual(describe(stream), expected)
+
+    def test_none(self):
+        for engine in tokenizer.JavaTokenizer.ENGINES:
+            expected = [(token_type, value, position, None) for
+                        token_type, value, position, javadoc in
+                        describe(tokenizer.tokenize(self.code, engine))]
+            tokens = tokenizer.tokenize(self.code, engine, javadoc_mode='none')
+
+            self.assertEqual(describe(tokens), expected)
+
+    def test_unknown_mode(self):
+        self.assertRaises(ValueError, tokenizer.tokenize, '',
+                          javadoc_mode='nope')
+
+    def test_documentation(self):
+        code = self.code.decode('utf-8')
+        field = parse.parse(code).types[0].fields[0]
+        lazy_field = parse.parse(code, javadoc_mode='span').types[0].fields[0]
+
+        self.assertTrue(isinstance(lazy_field._documentation, tokenizer.JavadocSpan))
+        self.assertEqual(lazy_field.documentation, field.documentation)
+        self.assertEqual(lazy_field._documentation, field.documentation)
+        self.assertEqual(lazy_field.doc_block.description, 'Field documentation')
+
+        field = parse.parse(code, javadoc_mode='none').types[0].fields[0]
+        self.assertEqual(field.documentation, None)
+        self.assertEqual(field.doc_block, None)
+
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        self.code = resource_string(__name__, 'source/tokenizer/Tokens.java')
+        self.expected = describe(tokenizer.tokenize(self.code))
+
+    def test_chunk_boundaries(self):
+        for engine in tokenizer.JavaTokenizer.ENGINES:
+            for chunk_size in (1, 2, 3, 5, 64, 65536):
+                tokens = tokenizer.tokenize_stream(io.BytesIO(self.code),
+                                                   engine, chunk_size)
+
+                self.assertEqual(describe(tokens), self.expected)
+
+    def test_text_stream_with_unicode_escapes(self):
+        code = u'int \\u0061 = "\\u00e9..." + 0x1.8p1;\n'
+
+        for chunk_size in (1, 2, 3, 7):
+            tokens = tokenizer.tokenize_stream(io.StringIO(code),
+                                               chunk_size=chunk_size)
+
+            self.assertEqual(describe(tokens), describe(tokenizer.tokenize(code)))
+
+    def test_tokenize_file(self):
+        handle, path = tempfile.mkstemp(suffix='.java')
+
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                f.write(self.code)
+
+            self.assertEqual(describe(tokenizer.tokenize_file(path, chunk_size=7)),
+                             self.expected)
+
+            with open(path, 'wb') as f:
+                f.write(u'String caf\u00e9;'.encode('iso-8859-1'))
+
+            tokens = list(tokenizer.tokenize_file(path))
+            self.assertEqual(tokens[1].value, u'caf\u00e9')
+        finally:
+            os.remove(path)
+
+    def test_tokenize_file_fallback(self):
+        handle, path = tempfile.mkstemp(suffix='.java')
+        os.close(handle)
+
+        ascii_first = b'int a;\n' * 20 + b'String caf\xe9;\n'
+        literal_first = b'String s = "\xc3\xa9";\n' + ascii_first
+        utf_8 = b'String s = "\xc3\xbc";\n// \xff\n' + b'int a;\n' * 20
+
+        try:
+            for data in (ascii_first, literal_first, utf_8):
+                with open(path, 'wb') as f:
+                    f.write(data)
+
+                # The same tokens as decode_source for every chunk size
+                expected = describe(tokenizer.tokenize(data))
+
+                for chunk_size in (1, 4, 5, 64, 4096):
+                    self.assertEqual(describe(tokenizer.tokenize_file(
+                        path, chunk_size=chunk_size)), expected)
+        finally:
+            os.remove(path)
+
+    def test_stream_encoding(self):
+        data = u'String caf\u00e9 = "\u00fc";'.encode('iso-8859-1')
+
+        with self.assertRaises(tokenizer.LexerError) as context:
+            list(tokenizer.tokenize_stream(io.BytesIO(data)))
+
+        self.assertEqual(str(context.exception),
+                         'Could not decode input data as utf_8; pass the '
+                         'encoding of the input')
+
+        self.assertEqual(describe(tokenizer.tokenize_stream(
+            io.BytesIO(data), chunk_size=4, encoding='iso-8859-1')),
+            describe(tokenizer.tokenize(data)))
+
+    def test_error_at_end_of_input(self):
+        tokens = tokenizer.tokenize_stream(io.StringIO(u'int x = "abc'),
+                                           chunk_size=2)
+
+        self.assertEqual(next(tokens).value, 'int')
+        self.assertEqual(next(tokens).value, 'x')
+        self.assertEqual(next(tokens).value, '=')
+        self.assertRaises(tokenizer.LexerError, next, tokens)
+
+    def test_error_in_later_chunk(self):
+        code = u'int a;\n' * 1000 + u'int # b;\n'
+
+        for engine in tokenizer.JavaTokenizer.ENGINES:
+            with self.assertRaises(tokenizer.LexerError) as context:
+                list(tokenizer.tokenize_stream(io.StringIO(code), engine,
+                                               chunk_size=100))
+
+            self.assertEqual(context.exception.position, (1001, 5))
+            self.assertEqual(str(context.exception),
+                             'Could not process token at "#", line 1001: '
+                             'int # b;')
+
+    def test_error_raised_when_found(self):
+        code = u'int # b;\n' + u'int a = 1;\n' * 10000
+        stream = io.StringIO(code)
+
+        with self.assertRaises(tokenizer.LexerError):
+            list(tokenizer.tokenize_stream(stream, chunk_size=64))
+
+        self.assertTrue(stream.tell() < 1000)
+
+        # An unterminated literal may still be closed by later input
+        code = u'x = "a\n' + u'b\n' * 100 + u'";'
+        tokens = tokenizer.tokenize_stream(io.StringIO(code), chunk_size=8)
+        self.assertEqual([token.value for token in tokens],
+                         ['x', '=', u'"a\n' + u'b\n' * 100 + u'"', ';'])
+
+
+class TestEncodings(unittest.TestCase):
+    def setUp(self):
+        self.text = u'String caf\u00e9 = "\u540d\u524d";'
+        self.expected = describe(tokenizer.tokenize(self.text))
+
+    def test_byte_order_marks(self):
+        for encoding, bom in (('utf_8', codecs.BOM_UTF8),
+                              ('utf_16_le', codecs.BOM_UTF16_LE),
+                              ('utf_16_be', codecs.BOM_UTF16_BE),
+                              ('utf_32_le', codecs.BOM_UTF32_LE),
+                              ('utf_32_be', codecs.BOM_UTF32_BE)):
+            data = bom + self.text.encode(encoding)
+
+            # The byte order mark wins over the hint
+            stream = tokenizer.token_stream(data, encoding='iso-8859-1')
+            self.assertEqual(stream.encoding, encoding)
+            self.assertEqual(describe(stream), self.expected)
+
+            for chunk_size in (1, 3, 64):
+                tokens = tokenizer.tokenize_stream(io.BytesIO(data),
+                                                   chunk_size=chunk_size)
+                self.assertEqual(describe(tokens), self.expected)
+
+    def test_encoding_hint(self):
+        data = self.text.encode('utf_16_le')
+        stream = tokenizer.token_stream(data, encoding='utf_16_le')
+
+        self.assertEqual(stream.encoding, 'utf_16_le')
+        self.assertEqual(describe(stream), self.expected)
+
+        self.assertEqual(describe(tokenizer.tokenize_stream(
+            io.BytesIO(data), chunk_size=5, encoding='utf_16_le')),
+            self.expected)
+
+        self.assertRaises(tokenizer.LexerError, tokenizer.token_stream,
+                          b'String caf\xe9;', encoding='utf_8')
+
+    def test_fallback(self):
+        self.assertEqual(tokenizer.decode_source(b'int x;'),
+                         (u'int x;', 'utf_8'))
+        self.assertEqual(tokenizer.decode_source(b'String caf\xe9;'),
+                         (u'String caf\u00e9;', 'iso-8859-1'))
+        self.assertEqual(tokenizer.decode_source(u'int x;'), (u'int x;', None))
+
+    def test_parse(self):
+        data = codecs.BOM_UTF8 + b'class A { String s = "\xc3\xa9"; }'
+        tree = parse.parse(data)
+
+        field = tree.types[0].fields[0]
+        self.assertEqual(field.declarators[0].initializer.value, u'"\u00e9"')
+
+
+class TestErrorRecovery(unittest.TestCase):
+    def assert_recovers(self, code, values, errors):
+        for engine in tokenizer.JavaTokenizer.ENGINES:
+            self.assertRaises(tokenizer.LexerError, list,
+                              tokenizer.tokenize(code, engine))
+
+            stream = tokenizer.token_stream(code, engine, ignore_errors=True)
+
+            self.assertEqual([(type(token).__name__, token.value)
+                              for token in stream], values)
+            self.assertEqual([(str(e).split(' at ')[0], e.position)
+                              for e in stream.errors], errors)
+
+    def test_character(self):
+        self.assert_recovers(
+            'int # x;',
+            [('BasicType', 'int'), ('ErrorToken', '#'), ('Identifier', 'x'),
+             ('Separator', ';')],
+            [('Could not process token', (1, 4))])
+
+    def test_literals(self):
+        self.assert_recovers(
+            's = "a\\q" + \'b\nint',
+            [('Identifier', 's'), ('Operator', '='), ('ErrorToken', '"a\\q"'),
+             ('Operator', '+'), ('ErrorToken', "'b"), ('BasicType', 'int')],
+            [('Illegal escape character', (1, 4)),
+             ('Unterminated character/string literal', (1, 12))])
+
+    def test_numbers(self):
+        self.assert_recovers(
+            'x = 0x1.8 + 1;',
+            [('Identifier', 'x'), ('Operator', '='), ('ErrorToken', '0x1.8'),
+             ('Operator', '+'), ('DecimalInteger', '1'), ('Separator', ';')],
+            [('Invalid hex float literal', (1, 4))])
+
+    def test_unicode_escapes(self):
+        self.assert_recovers(
+            'int \\uXYZ a; s = "\\u00zz";',
+            [('BasicType', 'int'), ('ErrorToken', '\\u'), ('Identifier', 'XYZ'),
+             ('Identifier', 'a'), ('Separator', ';'), ('Identifier', 's'),
+             ('Operator', '='), ('String', '"\\u00zz"'), ('Separator', ';')],
+            [('Invalid unicode escape', (1, 4)),
+             ('Invalid unicode escape', (1, 18))])
+
+    def test_parser_rejects_error_tokens(self):
+        tokens = tokenizer.tokenize('class A { int # x; }', ignore_errors=True)
+
+        self.assertRaises(parser.JavaSyntaxError,
+                          parser.Parser(tokens).parse)
+
+    def test_pickled_error(self):
+        stream = tokenizer.token_stream('#', ignore_errors=True)
+        error = pickle.loads(pickle.dumps(stream.errors[0]))
+
+        self.assertEqual(str(error), str(stream.errors[0]))
+        self.assertEqual(error.position, (1, 0))
+
+
+class TestRetokenize(unittest.TestCase):
+    def setUp(self):
+        self.code = resource_string(__name__, 'source/tokenizer/Tokens.java').decode('utf-8')
+
+    def assert_edit(self, code, offset, removed, inserted):
+        edited = code[:offset] + inserted + code[offset + removed:]
+
+        for engine in tokenizer.JavaTokenizer.ENGINES:
+            stream = tokenizer.token_stream(code, engine)
+            actual = tokenizer.retokenize(stream, offset, removed, inserted, engine)
+            expected = tokenizer.token_stream(edited, engine, lazy_positions=True)
+
+            self.assertEqual(describe(actual), describe(expected))
+
+        return edited
+
+    def test_edits(self):
+        code = self.code
+
+        for text, removed, inserted in [
+                ('MAX', 3, 'MAXIMUM'),           # replace a token
+                ('= 1, _under', 1, '=='),        # extend an operator
+                ('.25', 0, '1'),                 # '.' joined with a digit
+                ('... args', 1, ''),             # '...' split into separators
+                ('>>>= 1', 1, ''),               # shorter operator
+                (u'na\u00efve', 0, '" + "'),    # edit inside a string literal
+                ('/* a block', 2, '/'),          # remove a block comment start
+                ('comment spanning', 0, '*/ x /*'),
+                ('Field documentation', 5, 'Doc'),  # edit inside a javadoc
+                ('public void run', 0, '/** Runs */ ')]:
+            offset = code.index(text)
+            code = self.assert_edit(code, offset, removed, inserted)
+
+    def test_edit_at_ends(self):
+        self.assert_edit(self.code, 0, 0, 'int x;\n')
+        self.assert_edit(self.code, len(self.code), 0, '\nint x;')
+        self.assert_edit(self.code, 0, len(self.code), 'int x;')
+
+    def test_unicode_escapes(self):
+        code = u'int \\u0061 = 1; int b = 2;'
+        stream = tokenizer.token_stream(code)
+        edited = tokenizer.retokenize(stream, code.index('b'), 1, 'c')
+
+        self.assertEqual(describe(edited),
+                         describe(tokenizer.tokenize(code.replace('b', 'c'))))
+
+    def test_invalid_edit(self):
+        stream = tokenizer.token_stream(u'int x;')
+
+        self.assertRaises(ValueError, tokenizer.retokenize, stream, 4, 3, 'y')
+        self.assertRaises(tokenizer.LexerError, tokenizer.retokenize,
+                          stream, 4, 0, '"')
+
+
+class TestTokenizeMany(unittest.TestCase):
+    def setUp(self):
+        code = resource_string(__name__, 'source/tokenizer/Tokens.java')
+        self.sources = [code, u'int x = "', code.decode('utf-8'),
+                        u'int \\u0061 = 1;']
+
+    def check_results(self, results):
+        self.assertEqual(sorted(index for index, result in results),
+                         list(range(len(self.sources))))
+
+        for index, result in results:
+            code = self.sources[index]
+
+            if index == 1:
+                self.assertTrue(isinstance(result, tokenizer.LexerError))
+            else:
+                self.assertTrue(isinstance(result, tokenizer.TokenStream))
+                self.assertEqual(describe(result),
+                                 describe(tokenizer.tokenize(code)))
+
+    def test_pool(self):
+        results = list(tokenizer.tokenize_many(self.sources, workers=2))
+
+        self.assertEqual([index for index, result in results], [0, 1, 2, 3])
+        self.check_results(results)
+
+        self.check_results(list(tokenizer.tokenize_many(
+            self.sources, workers=2, ordered=False)))
+
+    def test_single_worker(self):
+        self.check_results(list(tokenizer.tokenize_many(self.sources, workers=1)))
+
+    def test_pickled_stream(self):
+        stream = tokenizer.token_stream(self.sources[0])
+        stream[0]
+        copy = pickle.loads(pickle.dumps(stream))
+
+        self.assertEqual(copy.materialized, {})
+        self.assertEqual(describe(copy), describe(stream))
+
+
+def dump_tree(node):
+    """ Returns a comparable representation of an AST including positions """
+
+    if isinstance(node, tree.Node):
+        return (type(node).__name__, node.position,
+                tuple(dump_tree(getattr(node, attr)) for attr in node.attrs))
+    elif isinstance(node, (list, tuple)):
+        return tuple(dump_tree(child) for child in node)
+    elif isinstance(node, set):
+        return tuple(sorted(node))
+    elif isinstance(node, tokenizer.JavaToken):
+        return (type(node).__name__, node.value)
+    else:
+        return node
+
+
+class TestTokenStream(unittest.TestCase):
+    def setUp(self):
+        self.code = resource_string(__name__, 'source/tokenizer/Tokens.java')
+
+    def test_matches_tokenize(self):
+        stream = tokenizer.token_stream(self.code)
+        tokens = list(tokenizer.tokenize(self.code))
+
+        self.assertEqual(len(stream), len(tokens))
+        self.assertEqual(describe(stream), describe(tokens))
+        self.assertEqual(describe(stream[-3:]), describe(tokens[-3:]))
+
+        for i, token in enumerate(tokens):
+            self.assertEqual(stream.value_at(i), token.value)
+            self.assertEqual(stream.type_at(i), type(token))
+
+    def test_materialized_once(self):
+        stream = tokenizer.token_stream(self.code)
+
+        self.assertTrue(stream[5] is stream[5])
+        self.assertEqual(len(stream.materialized), 1)
+
+    def test_parser_consumes_stream(self):
+        expected = parser.Parser(tokenizer.tokenize(self.code)).parse()
+        actual = parser.Parser(tokenizer.token_stream(self.code)).parse()
+
+        self.assertEqual(dump_tree(expected), dump_tree(actual))
+
+
+class TestReformat(unittest.TestCase):
+    def test_reformat_tokens(self):
+        code = 'class A { int x, y; void f() { if (a) { b = 1; } } }'
+
+        self.assertEqual(tokenizer.reformat_tokens(tokenizer.tokenize(code)),
+                         'class A {\n'
+                         '    int x, y;\n'
+                         '    void f() {\n'
+                         '        if(a) {\n'
+                         '            b = 1;\n'
+                         '            \n'
+                         '        }\n'
+                         '    }\n'
+                         '}\n')
+
+    def test_write_reformatted(self):
+        code = resource_string(__name__, 'source/tokenizer/Tokens.java')
+        expected = tokenizer.reformat_tokens(tokenizer.tokenize(code))
+
+        for batch_size in (1, 7, 4096):
+            output = io.StringIO()
+            tokenizer.write_reformatted(tokenizer.tokenize(code), output,
+                                        batch_size)
+
+            self.assertEqual(output.getvalue(), expected)
+
+    def test_consumes_tokens_lazily(self):
+        consumed = []
+
+        def tokens():
+            for token in tokenizer.tokenize('a; b; c; d;'):
+                consumed.append(token)
+                yield token
+
+        writes = []
+
+        class Output(object):
+            def write(self, text):
+                writes.append((text, len(consumed)))
+
+        tokenizer.write_reformatted(tokens(), Output(), batch_size=2)
+
+        self.assertEqual(writes[0], ('a;\n', 2))
+        self.assertEqual(''.join(text for text, _ in writes),
+                         'a;\nb;\nc;\nd;\n\n')
+
+
+if __name__ == "__main__":
+    unittest.main()
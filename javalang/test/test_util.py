@@ -1,6 +1,7 @@
 import unittest
 
-from ..util import LookAheadIterator
+from .. import parse, tokenizer
+from ..util import InternTable, LookAheadIterator
 
 
 class TestLookAheadIterator(unittest.TestCase):
@@ -65,5 +66,46 @@ class TestLookAheadIterator(unittest.TestCase):
         self.assertEqual(next(i), 14)
 
 
+class TestInternTable(unittest.TestCase):
+    def test_intern(self):
+        table = InternTable()
+        first = ''.join(['ja', 'va'])
+        second = ''.join(['ja', 'va'])
+
+        self.assertTrue(table.intern(first) is first)
+        self.assertTrue(table.intern(second) is first)
+        self.assertTrue(table.intern(first) is first)
+        self.assertEqual(table.intern(None), None)
+
+        self.assertEqual(len(table), 1)
+        self.assertEqual(table.hits, 1)
+        self.assertTrue(table.bytes_saved > 0)
+
+    def test_max_size(self):
+        table = InternTable(max_size=1)
+        table.intern('a')
+        value = ''.join(['b', 'c'])
+
+        self.assertTrue(table.intern(value) is value)
+        self.assertFalse('bc' in table)
+        self.assertEqual(len(table), 1)
+
+    def test_shared_across_session(self):
+        table = InternTable()
+        code = 'package java.util; class List { List next; }'
+
+        first = parse.parse(code, table)
+        second = parse.parse(code, table)
+
+        self.assertTrue(first.package.name is second.package.name)
+        self.assertTrue(first.types[0].name is second.types[0].name)
+
+        for tokens in (tokenizer.tokenize(code, intern_table=table),
+                       tokenizer.token_stream(code, intern_table=table)):
+            values = [token.value for token in tokens]
+            self.assertTrue(values[-4] is first.types[0].name)
+            self.assertTrue(values[-6] is values[-4])
+
+
 if __name__=="__main__":
     unittest.main()
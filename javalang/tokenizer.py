@@ -1,17 +1,168 @@
+import array
+import bisect
+import codecs
+import math
+import mmap
+import multiprocessing
+import os
 import re
+import string
+import struct
+import sys
 import unicodedata
 
 import six
 
 
 class LexerError(Exception):
-    pass
+    def __init__(self, message, position=None):
+        Exception.__init__(self, message)
+
+        # The (line, column) of the offending input, if known
+        self.position = position
+
+    def __reduce__(self):
+        return (type(self), (self.args[0], self.position))
+
+class JavadocSpan(object):
+    """ The location of a javadoc comment in data, recorded instead of its
+    text by the 'span' javadoc mode. The text is sliced out on demand.
+
+    """
+
+    __slots__ = ('data', 'start', 'end')
+
+    def __init__(self, data, start, end):
+        self.data = data
+        self.start = start
+        self.end = end
+
+    @property
+    def text(self):
+        return self.data[self.start:self.end]
+
+    def __eq__(self, other):
+        if isinstance(other, JavadocSpan):
+            other = other.text
+        return self.text == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.text)
+
+    def __repr__(self):
+        return 'JavadocSpan(%d, %d)' % (self.start, self.end)
 
 class JavaToken(object):
+    # Tokens created by the tokenizer only hold offsets into the shared source
+    # string. Their value and position are computed on first access.
+    __slots__ = ('_value', '_position', '_javadoc',
+                 '_data', '_start', '_end', '_line', '_column', '_lines')
+
     def __init__(self, value, position=None, javadoc=None):
-        self.value = value
-        self.position = position
-        self.javadoc = javadoc
+        self._value = value
+        self._position = position
+        self._javadoc = javadoc
+        self._data = None
+
+    @classmethod
+    def from_span(cls, data, start, end, line, column, javadoc=None,
+                  lines=None):
+        """ Create a token for data[start:end] found at line and column. If a
+        LineIndex is given as lines the position is resolved through it and
+        line and column are ignored.
+
+        """
+
+        token = cls.__new__(cls)
+        token._value = None
+        token._position = None
+        token._javadoc = javadoc
+        token._data = data
+        token._start = start
+        token._end = end
+        token._line = line
+        token._column = column
+        token._lines = lines
+
+        return token
+
+    @property
+    def value(self):
+        if self._value is None and self._data is not None:
+            self._value = self._data[self._start:self._end]
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+
+    @property
+    def position(self):
+        if self._position is None and self._data is not None:
+            if self._lines is not None:
+                self._position = self._lines.position(self._start)
+            else:
+                self._position = (self._line, self._column)
+        return self._position
+
+    @position.setter
+    def position(self, position):
+        self._position = position
+
+    @property
+    def javadoc(self):
+        """ The text of the javadoc comment preceding the token. The raw
+        _javadoc attribute may instead hold a JavadocSpan.
+
+        """
+
+        javadoc = self._javadoc
+
+        if isinstance(javadoc, JavadocSpan):
+            javadoc = self._javadoc = javadoc.text
+
+        return javadoc
+
+    @javadoc.setter
+    def javadoc(self, javadoc):
+        self._javadoc = javadoc
+
+    @property
+    def raw_javadoc(self):
+        """ The javadoc comment preceding the token as the tokenizer attached
+        it: its text, a JavadocSpan in the 'span' javadoc mode or None. Unlike
+        javadoc, a span is passed on as is rather than sliced into text.
+
+        """
+
+        return self._javadoc
+
+    @property
+    def end_position(self):
+        """ The position just past the last character of the token """
+
+        if self._data is not None and self._lines is not None:
+            return self._lines.position(self._end)
+
+        position = self.position
+        value = self.value
+
+        if position is None or value is None:
+            return None
+
+        newlines = value.count('\n')
+
+        if newlines == 0:
+            return (position[0], position[1] + len(value))
+
+        return (position[0] + newlines, len(value) - value.rfind('\n'))
+
+    def __reduce__(self):
+        # Pickle the materialized token rather than the source it refers to
+        return (type(self), (self.value, self.position, self.javadoc))
 
     def __repr__(self):
         if self.position:
@@ -28,9 +179,11 @@ class JavaToken(object):
         raise Exception("Direct comparison not allowed")
 
 class EndOfInput(JavaToken):
-    pass
+    __slots__ = ()
 
 class Keyword(JavaToken):
+    __slots__ = ()
+
     VALUES = set(['abstract', 'assert', 'boolean', 'break', 'byte', 'case',
                   'catch', 'char', 'class', 'const', 'continue', 'default',
                   'do', 'double', 'else', 'enum', 'extends', 'final',
@@ -43,57 +196,150 @@ class Keyword(JavaToken):
 
 
 class Modifier(Keyword):
+    __slots__ = ()
+
     VALUES = set(['abstract', 'default', 'final', 'native', 'private',
                   'protected', 'public', 'static', 'strictfp', 'synchronized',
                   'transient', 'volatile'])
 
 class BasicType(Keyword):
+    __slots__ = ()
+
     VALUES = set(['boolean', 'byte', 'char', 'double',
                   'float', 'int', 'long', 'short'])
 
 class Literal(JavaToken):
-    pass
+    __slots__ = ()
+
+    def numeric_value(self):
+        """ Converts a numeric literal to a Python int or float. Raises
+        ValueError for other literals and for numbers which are out of range
+        or malformed.
+
+        """
+
+        raise ValueError('Not a numeric literal: %s' % (self.value,))
+
+def _integer_value(literal, radix, prefix):
+    digits = literal.replace('_', '')
+    bits = 32
+
+    if digits[-1] in 'lL':
+        digits = digits[:-1]
+        bits = 64
+
+    value = int(digits[prefix:], radix)
+
+    if radix == 10:
+        # 2147483648 and 9223372036854775808L may only appear negated
+        if value > 1 << (bits - 1):
+            raise ValueError('Integer literal out of range: %s' % (literal,))
+        return value
+
+    if value >= 1 << bits:
+        raise ValueError('Integer literal out of range: %s' % (literal,))
+
+    # Hexadecimal, octal and binary literals are two's complement
+    if value >= 1 << (bits - 1):
+        value -= 1 << bits
+
+    return value
+
+def _float_value(literal, convert):
+    digits = literal.replace('_', '')
+    single = False
+
+    if digits[-1] in 'fFdD':
+        single = digits[-1] in 'fF'
+        digits = digits[:-1]
+
+    try:
+        value = convert(digits)
+
+        if single:
+            value = struct.unpack('f', struct.pack('f', value))[0]
+    except OverflowError:
+        value = float('inf')
+
+    if math.isinf(value):
+        raise ValueError('Floating point literal out of range: %s' % (literal,))
+
+    if value == 0.0:
+        # Only a literal of zero may round to zero
+        if digits[:2] in ('0x', '0X'):
+            mantissa = re.split('[pP]', digits[2:])[0]
+        else:
+            mantissa = re.split('[eE]', digits)[0]
+
+        if mantissa.strip('0.'):
+            raise ValueError('Floating point literal out of range: %s' % (literal,))
+
+    return value
 
 class Integer(Literal):
-    pass
+    __slots__ = ()
 
 class DecimalInteger(Literal):
-    pass
+    __slots__ = ()
+
+    def numeric_value(self):
+        return _integer_value(self.value, 10, 0)
 
 class OctalInteger(Integer):
-    pass
+    __slots__ = ()
+
+    def numeric_value(self):
+        return _integer_value(self.value, 8, 1)
 
 class BinaryInteger(Integer):
-    pass
+    __slots__ = ()
+
+    def numeric_value(self):
+        return _integer_value(self.value, 2, 2)
 
 class HexInteger(Integer):
-    pass
+    __slots__ = ()
+
+    def numeric_value(self):
+        return _integer_value(self.value, 16, 2)
 
 class FloatingPoint(Literal):
-    pass
+    __slots__ = ()
 
 class DecimalFloatingPoint(FloatingPoint):
-    pass
+    __slots__ = ()
+
+    def numeric_value(self):
+        return _float_value(self.value, float)
 
 class HexFloatingPoint(FloatingPoint):
-    pass
+    __slots__ = ()
+
+    def numeric_value(self):
+        return _float_value(self.value, float.fromhex)
 
 class Boolean(Literal):
+    __slots__ = ()
+
     VALUES = set(["true", "false"])
 
 class Character(Literal):
-    pass
+    __slots__ = ()
 
 class String(Literal):
-    pass
+    __slots__ = ()
 
 class Null(Literal):
-    pass
+    __slots__ = ()
 
 class Separator(JavaToken):
+    __slots__ = ()
+
     VALUES = set(['(', ')', '{', '}', '[', ']', ';', ',', '.'])
 
 class Operator(JavaToken):
+    __slots__ = ()
+
     MAX_LEN = 4
     VALUES = set(['>>>=', '>>=', '<<=',  '%=', '^=', '|=', '&=', '/=',
                   '*=', '-=', '+=', '<<', '--', '++', '||', '&&', '!=',
@@ -134,10 +380,457 @@ class Operator(JavaToken):
 
 
 class Annotation(JavaToken):
-    pass
+    __slots__ = ()
 
 class Identifier(JavaToken):
-    pass
+    __slots__ = ()
+
+class ErrorToken(JavaToken):
+    """ Input the tokenizer could not lex, produced instead of raising a
+    LexerError when errors are ignored.
+
+    """
+
+    __slots__ = ()
+
+
+class EscapeOffsets(object):
+    """ Maps offsets into unicode escape translated data back to offsets into
+    the original data. For every translated escape the offset of the
+    resulting character and the number of characters removed up to and
+    including that escape are recorded.
+
+    """
+
+    def __init__(self):
+        self.offsets = array.array('l')
+        self.removed = array.array('l')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def append(self, offset, removed):
+        self.offsets.append(offset)
+        self.removed.append(removed)
+
+    def original(self, offset):
+        escapes = bisect.bisect_left(self.offsets, offset)
+
+        if escapes == 0:
+            return offset
+
+        return offset + self.removed[escapes - 1]
+
+
+class LineIndex(object):
+    """ Resolves offsets into a source string to (line, column) positions.
+    The offsets of all line starts are collected in a single pass over the
+    source the first time a position is requested.
+
+    Columns follow the tokenizer's line tracking: they are counted from the
+    newline before a line, but from the start of the data on the first line
+    and from the end of a comment on the line it ends on. column_resets holds
+    the offsets of those comment ends in increasing order.
+
+    If an offset_map is given, offsets are first translated through it, and
+    first_line and first_column give the position of the start of data within
+    a larger source.
+
+    """
+
+    def __init__(self, data, offset_map=None, first_line=1, first_column=0,
+                 column_resets=None):
+        self.data = data
+        self.offset_map = offset_map
+        self.first_line = first_line
+        self.first_column = first_column
+        self.column_resets = column_resets
+        self.line_starts = None
+
+    def build(self):
+        line_starts = array.array('l', [0])
+        find = self.data.find
+
+        i = find('\n')
+        while i != -1:
+            line_starts.append(i + 1)
+            i = find('\n', i + 1)
+
+        self.line_starts = line_starts
+
+    def position(self, offset):
+        if self.line_starts is None:
+            self.build()
+
+        resets = self.column_resets
+        reset = None
+
+        if resets:
+            i = bisect.bisect_right(resets, offset)
+
+            if i:
+                reset = resets[i - 1]
+
+        if self.offset_map is not None:
+            offset = self.offset_map.original(offset)
+
+            if reset is not None:
+                reset = self.offset_map.original(reset)
+
+        line = bisect.bisect_right(self.line_starts, offset)
+
+        if line == 1:
+            start_of_line = -self.first_column
+        else:
+            start_of_line = self.line_starts[line - 1] - 1
+
+        if reset is not None and reset > start_of_line:
+            start_of_line = reset
+
+        return (self.first_line + line - 1, offset - start_of_line)
+
+
+# Token types in the order of their kind codes, as stored by TokenStream
+TOKEN_TYPES = [EndOfInput, Keyword, Modifier, BasicType, Literal, Integer,
+               DecimalInteger, OctalInteger, BinaryInteger, HexInteger,
+               FloatingPoint, DecimalFloatingPoint, HexFloatingPoint, Boolean,
+               Character, String, Null, Separator, Operator, Annotation,
+               Identifier, ErrorToken]
+
+TOKEN_KINDS = dict((token_type, kind)
+                   for kind, token_type in enumerate(TOKEN_TYPES))
+
+def _assign_kind_masks():
+    """ Give every token type its kind code as KIND, a bit of its own as
+    KIND_BIT and the bits of itself and all its token superclasses as
+    KIND_MASK, so that issubclass(a, b) is equivalent to
+    a.KIND_MASK & b.KIND_BIT.
+
+    """
+
+    JavaToken.KIND = None
+    JavaToken.KIND_BIT = 1 << len(TOKEN_TYPES)
+
+    for kind, token_type in enumerate(TOKEN_TYPES):
+        token_type.KIND = kind
+        token_type.KIND_BIT = 1 << kind
+
+    for token_type in [JavaToken] + TOKEN_TYPES:
+        token_type.KIND_MASK = 0
+
+        for base in token_type.__mro__:
+            if base is JavaToken or base in TOKEN_KINDS:
+                token_type.KIND_MASK |= base.KIND_BIT
+
+_assign_kind_masks()
+
+
+class TokenStream(object):
+    """ A compact sequence of tokens. Instead of one JavaToken object per
+    token the stream keeps one array per token attribute (kind code, start
+    and end offset into the source, line, column and javadoc index) and
+    materializes JavaToken objects only when they are indexed.
+
+    """
+
+    def __init__(self, data, line_index=None, intern_table=None):
+        self.data = data
+
+        # If a LineIndex is given the lines and columns columns are left empty
+        # and positions are resolved from the start offsets instead
+        self.line_index = line_index
+
+        # Values are shared through intern_table (see util.InternTable)
+        self.intern_table = intern_table
+
+        # The javadoc mode of the tokenizer which produced the stream, the
+        # encoding its source was decoded with (None if given as text) and
+        # the errors it ignored
+        self.javadoc_mode = 'text'
+        self.encoding = None
+        self.errors = list()
+
+        self.kinds = array.array('B')
+        self.starts = array.array('l')
+        self.ends = array.array('l')
+        self.lines = array.array('l')
+        self.columns = array.array('l')
+        self.javadocs = array.array('l')
+
+        # Javadoc comments referenced by the javadocs column, -1 means none
+        self.javadoc_values = list()
+
+        # The comment ends recorded by the tokenizer (see LineIndex)
+        self.column_resets = array.array('l')
+
+        self.materialized = dict()
+
+    def append(self, token_type, start, end, line, column, javadoc=None):
+        self.kinds.append(TOKEN_KINDS[token_type])
+        self.starts.append(start)
+        self.ends.append(end)
+
+        if self.line_index is None:
+            self.lines.append(line)
+            self.columns.append(column)
+
+        if javadoc is None:
+            self.javadocs.append(-1)
+        else:
+            self.javadocs.append(len(self.javadoc_values))
+            self.javadoc_values.append(javadoc)
+
+    def __getstate__(self):
+        # Only the columns are pickled, not the tokens materialized from them
+        state = self.__dict__.copy()
+        state['materialized'] = dict()
+        return state
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __iter__(self):
+        for i in range(len(self.kinds)):
+            yield self[i]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self.kinds)))]
+
+        if i < 0:
+            i += len(self.kinds)
+
+        token = self.materialized.get(i)
+
+        if token is None:
+            if self.line_index is None:
+                line, column = self.lines[i], self.columns[i]
+            else:
+                line = column = None
+
+            token = self.type_at(i).from_span(
+                self.data, self.starts[i], self.ends[i], line, column,
+                self.javadoc_at(i), self.line_index)
+
+            if self.intern_table is not None:
+                token.value = self.value_at(i)
+
+            self.materialized[i] = token
+
+        return token
+
+    def type_at(self, i):
+        return TOKEN_TYPES[self.kinds[i]]
+
+    def value_at(self, i):
+        if self.intern_table is not None:
+            return self.intern_table.intern(self.data[self.starts[i]:self.ends[i]])
+        return self.data[self.starts[i]:self.ends[i]]
+
+    def position_at(self, i):
+        if self.line_index is not None:
+            return self.line_index.position(self.starts[i])
+        return (self.lines[i], self.columns[i])
+
+    def javadoc_at(self, i):
+        index = self.javadocs[i]
+
+        if index == -1:
+            return None
+
+        return self.javadoc_values[index]
+
+
+def _operator_pattern():
+    # Longest operators first so the alternation implements maximal munch
+    operators = sorted(Operator.VALUES, key=len, reverse=True)
+    return '|'.join(re.escape(o) for o in operators)
+
+def _operator_trie():
+    """ Returns Operator.VALUES as a trie. Each node maps a character to an
+    (is_operator, children) pair, where is_operator tells whether the
+    characters up to and including this one form an operator.
+
+    """
+
+    trie = dict()
+
+    for operator in Operator.VALUES:
+        node = trie
+
+        for k, c in enumerate(operator):
+            entry = node.setdefault(c, [False, dict()])
+
+            if k == len(operator) - 1:
+                entry[0] = True
+
+            node = entry[1]
+
+    return trie
+
+_OPERATOR_TRIE = _operator_trie()
+
+_DEC_DIGITS = r'(?:_*[0-9])*'
+_HEX_DIGITS = r'(?:_*[0-9a-fA-F])*'
+_EXPONENT = r'[eE][+-]?' + _DEC_DIGITS
+
+# Numeric literals as alternatives named after their token types, in the order
+# in which they have to be tried. Shared by both scanning engines.
+_NUMBER_ALTERNATIVES = [
+    r'(?P<HexFloatingPoint>0[xX]' + _HEX_DIGITS + r'(?:\.' + _HEX_DIGITS +
+        ')?[pP][+-]?' + _DEC_DIGITS + '[fFdD]?)',
+    r'(?P<HexInteger>0[xX]' + _HEX_DIGITS + '[lL]?)',
+    r'(?P<BinaryInteger>0[bB](?:_*[01])*[lL]?)',
+    r'(?P<OctalInteger>0[0-7](?:_*[0-7])*[lL]?)',
+    r'(?P<DecimalFloatingPoint>[0-9]' + _DEC_DIGITS + r'(?:\.' + _DEC_DIGITS +
+        '(?:' + _EXPONENT + ')?[fFdD]?|' + _EXPONENT + '[fFdD]?|[fFdD])|'
+        r'\.[0-9]' + _DEC_DIGITS + '(?:' + _EXPONENT + ')?[fFdD]?)',
+    r'(?P<DecimalInteger>[0-9]' + _DEC_DIGITS + '[lL]?)',
+    ]
+
+_NUMBER_PATTERN = re.compile('|'.join(_NUMBER_ALTERNATIVES))
+
+# String and character literals with valid escapes only. Runs of ordinary
+# characters are matched at once rather than character by character.
+_STRING_LITERAL = r'"[^"\\]*(?:\\[btnfru"\'\\0-7][^"\\]*)*"'
+_CHARACTER_LITERAL = r"'[^'\\]*(?:\\[btnfru\"'\\0-7][^'\\]*)*'"
+
+_LITERAL_PATTERNS = {
+    '"': re.compile(_STRING_LITERAL),
+    "'": re.compile(_CHARACTER_LITERAL),
+}
+
+# The characters at which scanning a string or character literal has to stop
+_LITERAL_STOPS = {
+    '"': re.compile(r'["\\]'),
+    "'": re.compile(r"['\\]"),
+}
+
+_LITERAL_ESCAPES = frozenset('btnfru"\'\\01234567')
+
+# A unicode escape, or an escaped backslash which is matched so that a
+# following 'u' is not mistaken for the start of an escape
+_UNICODE_ESCAPE = re.compile(r'\\(?:\\|(u+)([0-9a-fA-F]{4})?)')
+
+_ASCII_IDENT_START = frozenset(string.ascii_letters + '_$')
+_ASCII_IDENT_PART = re.compile(r'[a-zA-Z0-9_$]*')
+
+def _identifier_classes(start_categories, part_categories):
+    """ Build regular expression character classes matching the code points
+    whose Unicode category is in start_categories and part_categories.
+
+    """
+
+    category = unicodedata.category
+    start_ranges = []
+    part_ranges = []
+
+    def add(ranges, code):
+        if ranges and ranges[-1][1] == code - 1:
+            ranges[-1][1] = code
+        else:
+            ranges.append([code, code])
+
+    for code in range(sys.maxunicode + 1):
+        c = category(six.unichr(code))
+
+        if c in start_categories:
+            add(start_ranges, code)
+
+        if c in part_categories:
+            add(part_ranges, code)
+
+    def char(code):
+        c = six.unichr(code)
+        return '\\' + c if c in '\\]^-' else c
+
+    def char_class(ranges):
+        return u'[%s]' % (u''.join(
+            char(low) if low == high else char(low) + u'-' + char(high)
+            for low, high in ranges),)
+
+    return char_class(start_ranges), char_class(part_ranges)
+
+# Token types of reserved words, everything else lexed as an identifier is an
+# Identifier
+_IDENTIFIER_TYPES = dict([(v, Keyword) for v in Keyword.VALUES] +
+                         [(v, Modifier) for v in Modifier.VALUES] +
+                         [(v, BasicType) for v in BasicType.VALUES] +
+                         [(v, Boolean) for v in Boolean.VALUES] +
+                         [('null', Null)])
+
+# Master pattern used by the 'regex' scanning engine. Each alternative is a
+# named group and the name of the group that matched determines how the match
+# is handled. The order of the alternatives mirrors the order of the checks in
+# JavaTokenizer.scan_default so that both engines agree on ambiguous
+# input. Whitespace before a token is matched along with it; the whitespace
+# alternative only matches before the end of the input or before input no
+# other alternative covers.
+_MASTER_PATTERN = re.compile(r'\s*(?:' + '|'.join([
+    r'(?P<whitespace>\s+)',
+    r'(?P<javadoc>/\*(?=\*)[\s\S]*?\*/)',
+    r'(?P<comment>/\*[\s\S]*?\*/)',
+    r'(?P<line_comment>//[^\n]*\n)',
+    r'(?P<eof_comment>//[^\n]*|/\*[\s\S]*)',
+    r'(?P<ellipsis>\.\.\.)',
+    r'(?P<Annotation>@)',
+    ] + _NUMBER_ALTERNATIVES + [
+    r'(?P<Separator>[(){}\[\];,.])',
+    r'(?P<String>' + _STRING_LITERAL + '|' + _CHARACTER_LITERAL + ')',
+    r'(?P<Identifier>[a-zA-Z_$][a-zA-Z0-9_$]*)',
+    r'(?P<Operator>' + _operator_pattern() + ')',
+    ]) + ')', re.UNICODE)
+
+# Byte order marks and the encodings they select, the UTF-32 little endian mark
+# before the UTF-16 one which it starts with
+_BYTE_ORDER_MARKS = (
+    (codecs.BOM_UTF32_LE, 'utf_32_le'),
+    (codecs.BOM_UTF32_BE, 'utf_32_be'),
+    (codecs.BOM_UTF8, 'utf_8'),
+    (codecs.BOM_UTF16_LE, 'utf_16_le'),
+    (codecs.BOM_UTF16_BE, 'utf_16_be'))
+
+def _sniff_bom(data):
+    """ Returns (encoding, length of the mark) if data starts with a byte
+    order mark and (None, 0) otherwise.
+
+    """
+
+    for mark, encoding in _BYTE_ORDER_MARKS:
+        if data.startswith(mark):
+            return encoding, len(mark)
+
+    return None, 0
+
+def decode_source(data, encoding=None):
+    """ Decodes Java source given as bytes and returns (text, encoding).
+
+    A byte order mark selects the encoding and is dropped. Otherwise the data
+    is decoded with encoding if given, or as UTF-8 if valid and as
+    ISO-8859-1 if not. Text is returned as is, with encoding None.
+
+    """
+
+    if isinstance(data, six.text_type):
+        return data, None
+
+    bom_encoding, skip = _sniff_bom(data)
+
+    if bom_encoding is not None:
+        encoding = bom_encoding
+        data = data[skip:]
+
+    if encoding is not None:
+        try:
+            return data.decode(encoding), encoding
+        except UnicodeDecodeError:
+            raise LexerError('Could not decode input data as %s' % (encoding,))
+
+    try:
+        return data.decode('utf_8'), 'utf_8'
+    except UnicodeDecodeError:
+        # Every byte sequence is valid ISO-8859-1
+        return data.decode('iso-8859-1'), 'iso-8859-1'
 
 
 class JavaTokenizer(object):
@@ -146,17 +839,69 @@ class JavaTokenizer(object):
 
     IDENT_PART_CATEGORIES = set(['Lu', 'Ll', 'Lt', 'Lm', 'Lo', 'Mc', 'Mn', 'Nd', 'Nl', 'Pc', 'Sc'])
 
-    def __init__(self, data):
+    # 'regex' is experimental: it produces the same tokens as 'default' but
+    # is not faster, so 'default' remains the fast path
+    ENGINES = ('default', 'regex')
+
+    # 'text' attaches the text of javadoc comments to the following token,
+    # 'span' a JavadocSpan and 'none' lexes them as ordinary comments
+    JAVADOC_MODES = ('text', 'span', 'none')
+
+    # Compiled character classes matching IDENT_START_CATEGORIES and
+    # IDENT_PART_CATEGORIES, built on first use by load_identifier_tables and
+    # shared by all instances
+    ident_start_pattern = None
+    ident_part_pattern = None
+
+    def __init__(self, data, engine='default', lazy_positions=False,
+                 intern_table=None, javadoc_mode='text', encoding=None,
+                 ignore_errors=False):
+        if engine not in self.ENGINES:
+            raise ValueError('Unknown tokenizer engine %r' % (engine,))
+
+        if javadoc_mode not in self.JAVADOC_MODES:
+            raise ValueError('Unknown javadoc mode %r' % (javadoc_mode,))
+
         self.data = data
+        self.engine = engine
+        self.javadoc_mode = javadoc_mode
+
+        # Encoding hint for binary data, replaced by the encoding actually
+        # used (None for text) once the data is decoded
+        self.encoding = encoding
+
+        # With ignore_errors input which can not be lexed is produced as an
+        # ErrorToken and the LexerError is appended to errors instead of
+        # being raised
+        self.ignore_errors = ignore_errors
+        self.errors = list()
+
+        # Invalid unicode escapes left in the data when errors are ignored,
+        # mapping their translated offset to the characters following 'u'
+        self.invalid_escapes = dict()
+
+        # With lazy_positions only offsets are recorded while lexing and
+        # positions are resolved through line_index when requested
+        self.lazy_positions = lazy_positions
+        self.line_index = None
+
+        # The position of the start of data within a larger source, if data
+        # is only a part of it (see _tokenize_chunks). Only lazily resolved
+        # positions take it into account
+        self.first_line = 1
+        self.first_column = 0
+
+        # The ends of comments, from which columns are counted on the line
+        # they end on (see LineIndex)
+        self.column_resets = array.array('l')
+
+        # Token values are shared through intern_table if one is given (see
+        # util.InternTable)
+        self.intern_table = intern_table
 
         self.current_line = 1
         self.start_of_line = 0
 
-        self.operators = [set() for i in range(0, Operator.MAX_LEN)]
-
-        for v in Operator.VALUES:
-            self.operators[len(v) - 1].add(v)
-
         self.whitespace_consumer = re.compile(r'[^\s]')
 
         self.javadoc = None
@@ -175,68 +920,101 @@ class JavaTokenizer(object):
 
         i = match.start()
 
-        start_of_line = self.data.rfind('\n', self.i, i)
+        if self.line_index is None:
+            self.count_lines(self.i, i)
+
+        self.i = i
+
+    def count_lines(self, i, j):
+        """ Update the line tracking for the skipped whitespace data[i:j] """
+
+        start_of_line = self.data.rfind('\n', i, j)
 
         if start_of_line != -1:
             self.start_of_line = start_of_line
-            self.current_line += self.data.count('\n', self.i, i)
+            self.current_line += self.data.count('\n', i, j)
 
-        self.i = i
+    def end_comment(self, i, j):
+        """ Update the line tracking for the skipped comment data[i:j]. On
+        the line a comment ends on, columns are counted from its end.
+
+        """
+
+        self.column_resets.append(j)
+
+        if self.line_index is None:
+            self.start_of_line = j
+            self.current_line += self.data.count('\n', i, j)
 
     def read_string(self):
-        delim = self.data[self.i]
+        data = self.data
+        delim = data[self.i]
+
+        m = _LITERAL_PATTERNS[delim].match(data, self.i)
+
+        if m is not None:
+            self.j = m.end()
+            return
 
-        state = 0
+        # Find out what is wrong with the literal, jumping from one backslash
+        # or delimiter to the next
+        search = _LITERAL_STOPS[delim].search
         j = self.i + 1
-        length = self.length
 
         while True:
-            if j >= length:
-                self.error('Unterminated character/string literal')
-
-            if state == 0:
-                if self.data[j] == '\\':
-                    state = 1
-                elif self.data[j] == delim:
-                    break
-
-            elif state == 1:
-                if self.data[j] in 'btnfru"\'\\':
-                    state = 0
-                elif self.data[j] in '0123':
-                    state = 2
-                elif self.data[j] in '01234567':
-                    state = 3
-                else:
-                    self.error('Illegal escape character', self.data[j])
+            m = search(data, j)
 
-            elif state == 2:
-                # Possibly long octal
-                if self.data[j] in '01234567':
-                    state = 3
-                elif self.data[j] == '\\':
-                    state = 1
-                elif self.data[j] == delim:
-                    break
+            if m is None:
+                self.unterminated_literal()
 
-            elif state == 3:
-                state = 0
+            j = m.start()
 
-                if self.data[j] == '\\':
-                    state = 1
-                elif self.data[j] == delim:
-                    break
+            if data[j] == delim:
+                break
 
-            j += 1
+            if j + 1 >= self.length:
+                self.unterminated_literal()
+
+            if data[j + 1] not in _LITERAL_ESCAPES:
+                self.error('Illegal escape character', data[j + 1])
+
+            j += 2
 
         self.j = j + 1
 
     def try_operator(self):
-        for l in range(min(self.length - self.i, Operator.MAX_LEN), 0, -1):
-            if self.data[self.i:self.i + l] in self.operators[l - 1]:
-                self.j = self.i + l
-                return True
-        return False
+        # Walk the operator trie as far as the input allows, remembering the
+        # end of the longest operator seen
+        data = self.data
+        node = _OPERATOR_TRIE
+        end = None
+        j = self.i
+
+        while j < self.length:
+            entry = node.get(data[j])
+
+            if entry is None:
+                break
+
+            j += 1
+            is_operator, node = entry
+
+            if is_operator:
+                end = j
+
+        if end is None:
+            return False
+
+        self.j = end
+        return True
+
+    def unterminated_literal(self):
+        # The literal runs to the end of the data, where j is left so that
+        # _tokenize_chunks can tell that more input may still end it
+        char = self.data[self.j:self.j + 1]
+        self.j = self.length
+
+        self.error('Unterminated character/string literal', char)
 
     def read_comment(self):
         if self.data[self.i + 1] == '/':
@@ -248,8 +1026,7 @@ class JavaTokenizer(object):
 
             i += 1
 
-            self.start_of_line = i
-            self.current_line += 1
+            self.end_comment(self.i, i)
             self.i = i
 
         else:
@@ -261,11 +1038,13 @@ class JavaTokenizer(object):
 
             i += 2
 
-            self.start_of_line = i
-            self.current_line += self.data.count('\n', self.i, i)
+            self.end_comment(self.i, i)
             self.i = i
 
     def try_javadoc_comment(self):
+        if self.javadoc_mode == 'none':
+            return False
+
         if self.i + 2 >= self.length or self.data[self.i + 2] != '*':
             return False
 
@@ -277,294 +1056,424 @@ class JavaTokenizer(object):
 
         j += 2
 
-        self.start_of_line = j
-        self.current_line += self.data.count('\n', self.i, j)
+        self.end_comment(self.i, j)
         self.j = j
 
         return True
 
-    def read_decimal_float_or_integer(self):
-        orig_i = self.i
-        self.j = self.i
+    def make_javadoc(self, i, j):
+        """ Returns what is attached to the next token for the javadoc comment
+        data[i:j] """
 
-        self.read_decimal_integer()
+        if self.javadoc_mode == 'span':
+            return JavadocSpan(self.data, i, j)
+        return self.data[i:j]
 
-        if self.data[self.j] not in '.eEfFdD':
-            return DecimalInteger
+    def char_at(self, i):
+        """ Returns the character at i, or NUL (which is not part of any
+        literal) past the end of the input.
 
-        if self.data[self.j] == '.':
-            self.i = self.j + 1
-            self.read_decimal_integer()
+        """
 
-        if self.data[self.j] in 'eE':
-            self.j = self.j + 1
+        if i < self.length:
+            return self.data[i]
+        return u'\x00'
 
-            if self.data[self.j] in '-+':
-                self.j = self.j + 1
+    def read_number(self):
+        """ Reads the numeric literal, which may start with '.', at i """
 
-            self.i = self.j
-            self.read_decimal_integer()
+        m = _NUMBER_PATTERN.match(self.data, self.i)
+        self.j = m.end()
 
-        if self.data[self.j] in 'fFdD':
-            self.j = self.j + 1
+        if (m.lastgroup == 'HexInteger' and
+                self.char_at(self.j) == '.'):
+            self.error('Invalid hex float literal')
 
-        self.i = orig_i
-        return DecimalFloatingPoint
+        return _ENGINE_TOKEN_TYPES[m.lastgroup]
 
-    def read_hex_integer_or_float(self):
-        orig_i = self.i
-        self.j = self.i + 2
+    def try_separator(self):
+        if self.data[self.i] in Separator.VALUES:
+            self.j = self.i + 1
+            return True
+        return False
 
-        self.read_hex_integer()
+    def decode_data(self):
+        data, self.encoding = decode_source(self.data, self.encoding)
+        return data
 
-        if self.data[self.j] not in '.pP':
-            return HexInteger
+    @classmethod
+    def load_identifier_tables(cls):
+        if cls.ident_part_pattern is None:
+            start_class, part_class = _identifier_classes(
+                cls.IDENT_START_CATEGORIES, cls.IDENT_PART_CATEGORIES)
 
-        if self.data[self.j] == '.':
-            self.j = self.j + 1
-            self.read_digits('0123456789abcdefABCDEF')
+            cls.ident_start_pattern = re.compile(start_class, re.UNICODE)
+            cls.ident_part_pattern = re.compile(part_class + '*', re.UNICODE)
 
-        if self.data[self.j] in 'pP':
-            self.j = self.j + 1
-        else:
-            self.error('Invalid hex float literal')
+    def is_java_identifier_start(self, c):
+        if c < u'\x80':
+            return c in _ASCII_IDENT_START
 
-        if self.data[self.j] in '-+':
-            self.j = self.j + 1
+        self.load_identifier_tables()
+        return self.ident_start_pattern.match(c) is not None
 
-        self.i = self.j
-        self.read_decimal_integer()
+    def read_identifier(self):
+        data = self.data
 
-        if self.data[self.j] in 'fFdD':
-            self.j = self.j + 1
+        j = _ASCII_IDENT_PART.match(data, self.i + 1).end()
 
-        self.i = orig_i
-        return HexFloatingPoint
+        # Only pay for the Unicode tables once a non-ASCII character shows up
+        if j < self.length and data[j] >= u'\x80':
+            self.load_identifier_tables()
+            j = self.ident_part_pattern.match(data, j).end()
 
-    def read_digits(self, digits):
-        tmp_i = 0
-        c = None
+        self.j = j
 
-        while True:
-            c = self.data[self.j + tmp_i]
+        return self.classify_identifier(data[self.i:j])
 
-            if c in digits:
-                self.j += 1 + tmp_i
-                tmp_i = 0
-            elif c == '_':
-                tmp_i += 1
-            else:
-                break
+    def classify_identifier(self, ident):
+        return _IDENTIFIER_TYPES.get(ident, Identifier)
 
-        if c in 'lL':
-            self.j += 1
+    def pre_tokenize(self):
+        """ Translates unicode escapes. Data without any escapes is used as
+        is; otherwise an EscapeOffsets map is kept so that positions can be
+        reported against the original data.
 
-    def read_decimal_integer(self):
-        self.j = self.i
-        self.read_digits('0123456789')
+        """
 
-    def read_hex_integer(self):
-        self.j = self.i + 2
-        self.read_digits('0123456789abcdefABCDEF')
+        data = self.decode_data()
 
-    def read_bin_integer(self):
-        self.j = self.i + 2
-        self.read_digits('01')
+        self.original_data = data
+        self.offset_map = None
 
-    def read_octal_integer(self):
-        self.j = self.i + 1
-        self.read_digits('01234567')
-
-    def read_integer_or_float(self, c, c_next):
-        if c == '0' and c_next in 'xX':
-            return self.read_hex_integer_or_float()
-        elif c == '0' and c_next in 'bB':
-            self.read_bin_integer()
-            return BinaryInteger
-        elif c == '0' and c_next in '01234567':
-            self.read_octal_integer()
-            return OctalInteger
-        else:
-            return self.read_decimal_float_or_integer()
+        if data.find('\\u') == -1:
+            self.data = data
+            self.length = len(data)
+            return
 
-    def try_separator(self):
-        if self.data[self.i] in Separator.VALUES:
-            self.j = self.i + 1
-            return True
-        return False
+        offset_map = EscapeOffsets()
+        removed = [0]
 
-    def decode_data(self):
-        # Encodings to try in order
-        codecs = ['utf_8', 'iso-8859-1']
+        def translate(match):
+            if match.group(1) is None:
+                # An escaped backslash can not start a unicode escape
+                return match.group(0)
 
-        # If data is already unicode don't try to redecode
-        if isinstance(self.data, six.text_type):
-            return self.data
+            digits = match.group(2)
 
-        for codec in codecs:
-            try:
-                data = self.data.decode(codec)
-                return data
-            except UnicodeDecodeError:
-                pass
+            if digits is None:
+                if self.ignore_errors:
+                    # Left as is and reported once positions are available
+                    self.invalid_escapes[match.start() - removed[0]] = \
+                        data[match.end():match.end() + 4]
+                    return match.group(0)
 
-        self.error('Could not decode input data')
+                self.error('Invalid unicode escape',
+                           data[match.end():match.end() + 4])
 
-    def is_java_identifier_start(self, c):
-        return unicodedata.category(c) in self.IDENT_START_CATEGORIES
+            translated = match.start() - removed[0]
+            removed[0] += match.end() - match.start() - 1
+            offset_map.append(translated, removed[0])
 
-    def read_identifier(self):
-        self.j = self.i + 1
+            return six.unichr(int(digits, 16))
+
+        self.data = _UNICODE_ESCAPE.sub(translate, data)
+        self.length = len(self.data)
+        self.offset_map = offset_map
 
-        while unicodedata.category(self.data[self.j]) in self.IDENT_PART_CATEGORIES:
-            self.j += 1
+    def tokenize(self):
+        scanner = self.scan()
+        data = self.data
+        lines = self.line_index
+
+        if self.intern_table is None:
+            for token_type, start, end, line, column, javadoc in scanner:
+                yield token_type.from_span(data, start, end, line, column,
+                                           javadoc, lines)
+            return
 
-        ident = self.data[self.i:self.j]
-        if ident in Keyword.VALUES:
-            token_type = Keyword
+        intern = self.intern_table.intern
 
-            if ident in BasicType.VALUES:
-                token_type = BasicType
-            elif ident in Modifier.VALUES:
-                token_type = Modifier
+        for token_type, start, end, line, column, javadoc in scanner:
+            token = token_type.from_span(data, start, end, line, column,
+                                         javadoc, lines)
+            token.value = intern(data[start:end])
+            yield token
 
-        elif ident in Boolean.VALUES:
-            token_type = Boolean
-        elif ident == 'null':
-            token_type = Null
-        else:
-            token_type = Identifier
+    def token_stream(self):
+        """ Returns the tokens as a TokenStream instead of JavaToken objects """
 
-        return token_type
+        scanner = self.scan()
+        stream = TokenStream(self.data, self.line_index, self.intern_table)
+        stream.javadoc_mode = self.javadoc_mode
+        stream.column_resets = self.column_resets
+        append = stream.append
 
-    def pre_tokenize(self):
-        new_data = list()
-        data = self.decode_data()
+        for token in scanner:
+            append(*token)
 
-        i = 0
-        j = 0
-        length = len(data)
+        stream.encoding = self.encoding
+        stream.errors = self.errors
+        return stream
 
-        NONE         = 0
-        ELIGIBLE     = 1
-        MARKER_FOUND = 2
+    def scan(self, start=0):
+        """ Generates a (token_type, start, end, line, column, javadoc) tuple
+        for each token using the configured engine. Scanning begins at offset
+        start of the translated data, which must not lie within a token or
+        comment.
 
-        state = NONE
+        """
 
-        while j < length:
-            if state == NONE:
-                j = data.find('\\', j)
+        self.reset()
+        self.i = start
 
-                if j == -1:
-                    j = length
-                    break
+        # Convert unicode escapes
+        self.pre_tokenize()
 
-                state = ELIGIBLE
+        if self.lazy_positions or self.offset_map is not None:
+            self.line_index = LineIndex(self.original_data, self.offset_map,
+                                        self.first_line, self.first_column,
+                                        self.column_resets)
 
-            elif state == ELIGIBLE:
-                c = data[j]
+        if self.invalid_escapes:
+            self.report_invalid_escapes()
 
-                if c == 'u':
-                    state = MARKER_FOUND
-                    new_data.append(data[i:j - 1])
-                else:
-                    state = NONE
+        if self.engine == 'regex':
+            return self.scan_regex()
+        return self.scan_default()
 
-            elif state == MARKER_FOUND:
-                c = data[j]
+    def dispatch_table(self):
+        """ Returns a dict mapping the first character of a token, comment or
+        whitespace to the method lexing it. Each method returns the token
+        type, or None if it skipped whitespace or a comment. Characters not
+        in the table are handled by scan_other.
 
-                if c != 'u':
-                    try:
-                        escape_code = int(data[j:j+4], 16)
-                    except ValueError:
-                        self.error('Invalid unicode escape', data[j:j+4])
+        """
 
-                    new_data.append(six.unichr(escape_code))
+        table = dict()
 
-                    i = j + 4
-                    j = i
+        for c in Operator.VALUES:
+            table[c[0]] = self.scan_operator
 
-                    state = NONE
+        for c in Separator.VALUES:
+            table[c] = self.scan_separator
 
-                    continue
+        for c in _ASCII_IDENT_START:
+            table[c] = self.read_identifier
 
-            j = j + 1
+        for c in '0123456789':
+            table[c] = self.read_number
 
-        new_data.append(data[i:])
+        for c in ' \t\n\r\f':
+            table[c] = self.consume_whitespace
 
-        self.data = ''.join(new_data)
-        self.length = len(self.data)
+        table['"'] = table["'"] = self.scan_string
+        table['@'] = self.scan_annotation
+        table['.'] = self.scan_dot
+        table['/'] = self.scan_slash
 
-    def tokenize(self):
-        self.reset()
+        return table
 
-        # Convert unicode escapes
-        self.pre_tokenize()
+    def scan_default(self):
+        dispatch = self.dispatch_table()
+        scan_other = self.scan_other
 
         while self.i < self.length:
-            token_type = None
+            try:
+                token_type = dispatch.get(self.data[self.i], scan_other)()
+            except LexerError as e:
+                token_type = self.recover(e)
 
-            c = self.data[self.i]
-            c_next = None
-            startswith = c
+            if token_type is None:
+                continue
 
-            if self.i + 1 < self.length:
-                c_next = self.data[self.i + 1]
-                startswith = c + c_next
+            yield (token_type, self.i, self.j, self.current_line,
+                   self.i - self.start_of_line, self.javadoc)
 
-            if c.isspace():
-                self.consume_whitespace()
-                continue
+            if self.javadoc:
+                self.javadoc = None
 
-            elif startswith in ("//", "/*"):
-                if startswith == "/*" and self.try_javadoc_comment():
-                    self.javadoc = self.data[self.i:self.j]
-                    self.i = self.j
-                else:
-                    self.read_comment()
-                continue
+            self.i = self.j
 
-            elif startswith == '..' and self.try_operator():
-                # Ensure we don't mistake a '...' operator as a sequence of
-                # three '.' separators. This is done as an optimization instead
-                # of moving try_operator higher in the chain because operators
-                # aren't as common and try_operator is expensive
-                token_type = Operator
+    def scan_operator(self):
+        if not self.try_operator():
+            self.error('Could not process token', self.data[self.i])
 
-            elif c == '@':
-                token_type = Annotation
-                self.j = self.i + 1
+        return Operator
 
-            elif c == '.' and c_next.isdigit():
-                token_type = self.read_decimal_float_or_integer()
+    def scan_separator(self):
+        self.j = self.i + 1
+        return Separator
 
-            elif self.try_separator():
-                token_type = Separator
+    def scan_annotation(self):
+        self.j = self.i + 1
+        return Annotation
 
-            elif c in ("'", '"'):
-                token_type = String
-                self.read_string()
+    def scan_string(self):
+        self.read_string()
+        return String
 
-            elif c in '0123456789':
-                token_type = self.read_integer_or_float(c, c_next)
+    def scan_dot(self):
+        c_next = self.char_at(self.i + 1)
 
-            elif self.is_java_identifier_start(c):
-                token_type = self.read_identifier()
+        if c_next == '.' and self.try_operator():
+            # '...' is an operator, '..' two separators
+            return Operator
 
-            elif self.try_operator():
-                token_type = Operator
+        elif '0' <= c_next <= '9':
+            return self.read_number()
+
+        return self.scan_separator()
+
+    def scan_slash(self):
+        c_next = self.char_at(self.i + 1)
+
+        if c_next == '*' and self.try_javadoc_comment():
+            self.javadoc = self.make_javadoc(self.i, self.j)
+            self.i = self.j
+
+        elif c_next in ('/', '*'):
+            self.read_comment()
+
+        else:
+            return self.scan_operator()
+
+    def scan_other(self):
+        c = self.data[self.i]
+
+        if c.isspace():
+            self.consume_whitespace()
+
+        elif self.is_java_identifier_start(c):
+            return self.read_identifier()
+
+        else:
+            self.error('Could not process token', c)
+
+    def scan_regex(self):
+        """ Alternative scanning engine that recognizes every token, together
+        with the whitespace before it, with a single match of a compiled
+        master pattern instead of dispatching on individual characters.
+        Produces the same tokens and positions as scan_default.
 
+        This engine is experimental and not the fast path: on typical
+        sources it runs somewhat slower than scan_default, whose dispatch on
+        the first character already avoids most of the work.
+
+        """
+
+        data = self.data
+        length = self.length
+        match = _MASTER_PATTERN.match
+        token_types = _ENGINE_TOKEN_TYPES
+        identifier_types = _IDENTIFIER_TYPES
+        track_lines = self.line_index is None
+        javadoc_mode = self.javadoc_mode
+
+        while self.i < length:
+            i = self.i
+            m = match(data, i)
+
+            if m is None:
+                try:
+                    token_type = self.scan_fallback()
+                except LexerError as e:
+                    token_type = self.recover(e)
+
+                j = self.j
+                kind = None
             else:
-                self.error('Could not process token', c)
+                kind = m.lastgroup
+                j = m.end()
+                start = m.start(kind)
+
+                if start != i:
+                    # Skip the whitespace matched before the token
+                    if track_lines:
+                        start_of_line = data.rfind('\n', i, start)
+
+                        if start_of_line != -1:
+                            self.start_of_line = start_of_line
+                            self.current_line += data.count('\n', i, start)
+
+                    i = self.i = start
+
+            if kind == 'Identifier':
+                if j < length and data[j] >= u'\x80':
+                    # Fall back to the category checks for the non-ASCII tail
+                    token_type = self.read_identifier()
+                    j = self.j
+                else:
+                    token_type = identifier_types.get(data[i:j], Identifier)
 
-            position = (self.current_line, self.i - self.start_of_line)
-            token = token_type(self.data[self.i:self.j], position, self.javadoc)
-            yield token
+            elif kind in token_types:
+                token_type = token_types[kind]
+
+                if kind == 'HexInteger' and j < length and data[j] == '.':
+                    self.j = j
+
+                    try:
+                        self.error('Invalid hex float literal')
+                    except LexerError as e:
+                        token_type = self.recover(e)
+                        j = self.j
+
+            elif kind == 'ellipsis':
+                token_type = Operator
+
+            elif kind == 'whitespace':
+                # Only matched on its own before the end of the input or
+                # before input the pattern does not cover
+                if track_lines:
+                    self.count_lines(i, j)
+
+                self.i = j
+                continue
+
+            elif kind == 'line_comment':
+                self.end_comment(i, j)
+                self.i = j
+                continue
+
+            elif kind == 'comment' or kind == 'javadoc':
+                self.end_comment(i, j)
+                self.i = j
+
+                if kind == 'javadoc' and javadoc_mode != 'none':
+                    self.javadoc = self.make_javadoc(i, j)
+                    self.j = j
+                continue
+
+            elif kind == 'eof_comment':
+                break
+
+            yield (token_type, i, j, self.current_line, i - self.start_of_line,
+                   self.javadoc)
 
             if self.javadoc:
                 self.javadoc = None
 
-            self.i = self.j
+            # j is left at the end of the last token (or javadoc comment), as
+            # in the default engine, for the errors raised by scan_fallback
+            self.i = self.j = j
+
+    def scan_fallback(self):
+        """ Handles input the master pattern does not cover: identifiers that
+        start with a non-ASCII character and malformed tokens, for which the
+        errors raised by the default engine are reproduced.
+
+        """
+
+        c = self.data[self.i]
+
+        if c in ("'", '"'):
+            self.read_string()
+            return String
+
+        elif self.is_java_identifier_start(c):
+            return self.read_identifier()
+
+        self.error('Could not process token', c)
 
     def error(self, message, char=None):
         # Provide additional information in the errors message
@@ -572,72 +1481,526 @@ class JavaTokenizer(object):
         line_end = self.data.find('\n', self.i)
         line = self.data[line_start:line_end].strip()
 
-        line_number = self.current_line
+        if self.line_index is None:
+            position = (self.current_line, self.i - self.start_of_line)
+        else:
+            position = self.line_index.position(self.i)
 
         if not char:
-            char = self.data[self.j]
+            char = self.data[self.j:self.j + 1]
+
+        message = u'%s at "%s", line %s: %s' % (message, char, position[0], line)
+
+        raise LexerError(message, position)
+
+    def recover(self, error):
+        """ Records error and returns ErrorToken after pointing j past the
+        input that caused it: the rest of a malformed literal on its line,
+        the rest of a malformed number or a single character. Raises error
+        unless errors are ignored.
+
+        """
+
+        if not self.ignore_errors:
+            raise error
+
+        c = self.data[self.i]
+
+        if self.i in self.invalid_escapes:
+            # Already reported by report_invalid_escapes
+            m = _ESCAPE_RECOVERY.match(self.data, self.i)
+        else:
+            self.errors.append(error)
 
-        message = u'%s at "%s", line %s: %s' % (message, char, line_number, line)
+            if c in _LITERAL_RECOVERY:
+                m = _LITERAL_RECOVERY[c].match(self.data, self.i)
+            elif c in '0123456789.':
+                m = _NUMBER_RECOVERY.match(self.data, self.i)
+            else:
+                m = None
+
+        if m is None:
+            self.j = self.i + 1
+        else:
+            self.j = m.end()
+
+        return ErrorToken
+
+    def report_invalid_escapes(self):
+        """ Appends an error for each invalid unicode escape left in the data
+        to errors. Escapes in literals and comments are only reported here.
+
+        """
 
-        raise LexerError(message)
+        start = self.i
 
-def tokenize(code):
-    tokenizer = JavaTokenizer(code)
+        for i in sorted(self.invalid_escapes):
+            self.i = i
+
+            try:
+                self.error('Invalid unicode escape', self.invalid_escapes[i])
+            except LexerError as e:
+                self.errors.append(e)
+
+        self.i = start
+
+# Spans covered by an ErrorToken for malformed input starting with an invalid
+# unicode escape, a quote or a digit. Literals end at their closing delimiter
+# or the end of the line.
+_ESCAPE_RECOVERY = re.compile(r'\\u+[0-9a-fA-F]{0,3}')
+_LITERAL_RECOVERY = dict(
+    (delim, re.compile(delim + r'(?:[^\\\n' + delim + r']|\\.)*' + delim + '?'))
+    for delim in ('"', "'"))
+_NUMBER_RECOVERY = re.compile(r'[0-9a-zA-Z_$.]+')
+
+_ENGINE_TOKEN_TYPES = dict((token_type.__name__, token_type) for token_type in (
+    Annotation, Separator, String, Operator, DecimalFloatingPoint,
+    HexFloatingPoint, HexInteger, BinaryInteger, OctalInteger, DecimalInteger))
+
+def tokenize(code, engine='default', lazy_positions=False, intern_table=None,
+             javadoc_mode='text', encoding=None, ignore_errors=False):
+    tokenizer = JavaTokenizer(code, engine, lazy_positions, intern_table,
+                              javadoc_mode, encoding, ignore_errors)
     return tokenizer.tokenize()
 
-def reformat_tokens(tokens):
+def token_stream(code, engine='default', lazy_positions=False,
+                 intern_table=None, javadoc_mode='text', encoding=None,
+                 ignore_errors=False):
+    tokenizer = JavaTokenizer(code, engine, lazy_positions, intern_table,
+                              javadoc_mode, encoding, ignore_errors)
+    return tokenizer.token_stream()
+
+def retokenize(stream, offset, removed, inserted, engine='default'):
+    """ Returns a TokenStream for the source of stream after replacing the
+    removed characters at offset by inserted.
+
+    Only the tokens around the edit are lexed again: lexing restarts at the
+    end of the last token which can not be extended by the edit and stops at
+    the first new token which starts where an old token after the edit
+    started. The remaining tokens are copied with their offsets shifted.
+    The returned stream always resolves positions lazily.
+
+    """
+
+    line_index = stream.line_index
+
+    if line_index is None:
+        source = stream.data
+    else:
+        source = line_index.data
+
+    if offset < 0 or removed < 0 or offset + removed > len(source):
+        raise ValueError('Edit outside of the source')
+
+    source = source[:offset] + inserted + source[offset + removed:]
+
+    if ((line_index is not None and line_index.offset_map is not None)
+            or source.find('\\u') != -1):
+        # Offsets into translated data do not follow the edit
+        return token_stream(source, engine, True, stream.intern_table,
+                            stream.javadoc_mode)
+
+    delta = len(inserted) - removed
+    inserted_end = offset + len(inserted)
+
+    # Tokens ending this close to the edit may be extended by it
+    keep = bisect.bisect_right(stream.ends, offset - Operator.MAX_LEN)
+    restart = stream.ends[keep - 1] if keep else 0
+
+    tokenizer = JavaTokenizer(source, engine, True, stream.intern_table,
+                              stream.javadoc_mode)
+    scanner = tokenizer.scan(restart)
+
+    result = TokenStream(tokenizer.data, tokenizer.line_index,
+                         stream.intern_table)
+    result.javadoc_mode = stream.javadoc_mode
+    result.kinds = stream.kinds[:keep]
+    result.starts = stream.starts[:keep]
+    result.ends = stream.ends[:keep]
+    result.javadocs = stream.javadocs[:keep]
+
+    # Javadoc indices increase with the token index
+    if keep:
+        result.javadoc_values = stream.javadoc_values[:max(result.javadocs) + 1]
+
+    old_starts = stream.starts
+    resume = len(stream)
+
+    for token_type, start, end, _, _, javadoc in scanner:
+        if start >= inserted_end:
+            i = bisect.bisect_left(old_starts, start - delta, keep)
+
+            if (i < len(old_starts) and old_starts[i] == start - delta
+                    and stream.javadoc_at(i) == javadoc):
+                resume = i
+                break
+
+        result.append(token_type, start, end, None, None, javadoc)
+
+    result.kinds.extend(stream.kinds[resume:])
+    result.starts.extend(array.array('l', [start + delta for start
+                                           in stream.starts[resume:]]))
+    result.ends.extend(array.array('l', [end + delta for end
+                                         in stream.ends[resume:]]))
+
+    javadocs = result.javadocs
+    javadoc_values = result.javadoc_values
+
+    for i in range(resume, len(stream)):
+        javadoc = stream.javadoc_at(i)
+
+        if javadoc is None:
+            javadocs.append(-1)
+        else:
+            javadocs.append(len(javadoc_values))
+            javadoc_values.append(javadoc)
+
+    # Comment ends before the lexed span are kept and those after it shifted
+    old_resets = stream.column_resets
+    resets = old_resets[:bisect.bisect_right(old_resets, restart)]
+    resets.extend(tokenizer.column_resets)
+
+    if resume < len(stream):
+        resume_start = stream.starts[resume]
+        resets.extend(array.array('l', [
+            reset + delta for reset
+            in old_resets[bisect.bisect_right(old_resets, resume_start):]]))
+
+    result.column_resets = result.line_index.column_resets = resets
+
+    return result
+
+def _tokenize_source(args):
+    """ Worker of tokenize_many, returns (index, stream, error) """
+
+    index, code, engine, ignore_errors = args
+
+    try:
+        stream = token_stream(code, engine, lazy_positions=True,
+                              ignore_errors=ignore_errors)
+    except LexerError as e:
+        return (index, None, e)
+
+    if stream.data is code:
+        # The caller still holds the source, so it is not sent back
+        stream.data = stream.line_index.data = None
+
+    return (index, stream, None)
+
+def tokenize_many(sources, workers=None, engine='default', ordered=True,
+                  chunksize=1, ignore_errors=False):
+    """ Tokenize each of sources in a pool of worker processes, using one
+    per CPU if workers is None.
+
+    Generates an (index, result) tuple for every source, where result is a
+    TokenStream, or the LexerError raised for the source. Results are
+    generated in the order of sources if ordered is true and as soon as
+    they are available otherwise. Streams are sent back from the workers
+    as their compact columns rather than as JavaToken objects. With
+    ignore_errors lexical errors are left in the streams as ErrorTokens
+    (see JavaTokenizer).
+
+    """
+
+    sources = list(sources)
+    tasks = [(index, code, engine, ignore_errors)
+             for index, code in enumerate(sources)]
+
+    if workers == 1:
+        results = six.moves.map(_tokenize_source, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(workers)
+
+        if ordered:
+            results = pool.imap(_tokenize_source, tasks, chunksize)
+        else:
+            results = pool.imap_unordered(_tokenize_source, tasks, chunksize)
+
+    try:
+        for index, stream, error in results:
+            if error is not None:
+                yield (index, error)
+                continue
+
+            if stream.data is None:
+                stream.data = stream.line_index.data = sources[index]
+
+            yield (index, stream)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+# Matches a trailing backslash that may start a unicode escape completed by
+# the next chunk of streamed input
+_PARTIAL_ESCAPE = re.compile(r'\\(?:u+[0-9a-fA-F]{0,3})?\Z')
+
+def _tokenize_chunks(read, engine, chunk_size, encoding):
+    """ Tokenize the text returned by successive read(chunk_size) calls.
+
+    Each pass lexes the unconsumed remainder of the input plus the next
+    chunk. Only tokens which can not be extended by more input are produced;
+    the last token of a pass and anything close to the end of the buffer are
+    lexed again together with the next chunk.
+
+    """
+
+    decoder = None
+    buffer = u''
+    pending = u''
+    line = 1
+    column = 0
+    eof = False
+
+    while not eof:
+        chunk = read(chunk_size)
+        eof = not chunk
+
+        if isinstance(chunk, six.binary_type):
+            if decoder is None:
+                # Read enough of the input to recognize any byte order mark
+                while len(chunk) < 4 and not eof:
+                    more = read(chunk_size)
+                    eof = not more
+                    chunk += more
+
+                bom_encoding, skip = _sniff_bom(chunk)
+
+                if bom_encoding is not None:
+                    encoding = bom_encoding
+                    chunk = chunk[skip:]
+                elif encoding is None:
+                    encoding = 'utf_8'
+
+                decoder = codecs.getincrementaldecoder(encoding)()
+
+            try:
+                chunk = decoder.decode(chunk, eof)
+            except UnicodeDecodeError:
+                raise LexerError('Could not decode input data as %s; pass the '
+                                 'encoding of the input' % (encoding,))
+
+        text = pending + chunk
+        pending = u''
+
+        if not eof:
+            partial = _PARTIAL_ESCAPE.search(text)
+
+            if partial:
+                pending = text[partial.start():]
+                text = text[:partial.start()]
+
+        # Positions, including those of errors, are resolved against the
+        # untranslated buffer, which starts at line, column of the whole input
+        tokenizer = JavaTokenizer(buffer + text, engine, lazy_positions=True)
+        tokenizer.first_line = line
+        tokenizer.first_column = column
+        tokens = list()
+        error = None
+
+        try:
+            for token in tokenizer.scan():
+                tokens.append(token)
+        except LexerError as e:
+            error = e
+
+        data = tokenizer.data
+        original = tokenizer.original_data
+        offset_map = tokenizer.offset_map
+        lines = tokenizer.line_index
+
+        # A token followed by fewer characters than the longest operator may
+        # still be extended (or merged, as in '..' + '.')
+        limit = len(data) - Operator.MAX_LEN
+        final = eof
+
+        if error is not None and max(tokenizer.i, tokenizer.j) < limit:
+            # The error was found without looking into the held back tail,
+            # so more input can not undo it
+            final = True
+
+        if final:
+            safe = len(tokens)
+        else:
+            safe = 0
+
+            while safe < len(tokens) - 1 and tokens[safe][2] <= limit:
+                safe += 1
+
+        for token_type, start, end, _, _, javadoc in tokens[:safe]:
+            yield token_type(data[start:end], lines.position(start), javadoc)
+
+        if error is not None and final:
+            raise error
+
+        if safe:
+            cut = tokens[safe - 1][2]
+            line, column = lines.position(cut)
+
+            if offset_map is not None:
+                cut = offset_map.original(cut)
+
+            buffer = original[cut:]
+        else:
+            buffer = original
+
+def tokenize_stream(fileobj, engine='default', chunk_size=65536,
+                    encoding=None):
+    """ Tokenize Java source read from a text or binary file object in chunks
+    of chunk_size. Binary input is decoded incrementally with the encoding
+    selected by its byte order mark, if any, and otherwise with encoding,
+    which defaults to UTF-8.
+
+    Unlike tokenize and tokenize_file, tokenize_stream does not fall back to
+    ISO-8859-1, since tokens may already have been produced when an invalid
+    byte shows up and the stream can not be read again. Other input without
+    a byte order mark requires encoding; LexerError is raised otherwise.
+
+    """
+
+    return _tokenize_chunks(fileobj.read, engine, chunk_size, encoding)
+
+def tokenize_file(path, engine='default', chunk_size=65536, encoding=None):
+    """ Tokenize the Java source file at path through a memory map so that
+    memory use is bounded by chunk_size rather than by the file size. A byte
+    order mark selects the encoding; otherwise, if no encoding is given, the
+    file is decoded as UTF-8 if valid and as ISO-8859-1 otherwise.
+
+    Without an encoding, the whole file is first checked to be valid UTF-8,
+    without keeping the decoded text, so that the encoding is settled before
+    any token is produced. It is then decoded once more as it is tokenized.
+
+    """
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            if encoding is None:
+                encoding = _detect_encoding(mapped.read, chunk_size)
+                mapped.seek(0)
+
+            for token in _tokenize_chunks(mapped.read, engine, chunk_size,
+                                          encoding):
+                yield token
+        finally:
+            mapped.close()
+
+def _detect_encoding(read, chunk_size):
+    """ Returns the encoding decode_source would pick for the data returned
+    by successive read(chunk_size) calls.
+
+    """
+
+    chunk = read(chunk_size)
+    bom_encoding, _ = _sniff_bom(chunk)
+
+    if bom_encoding is not None:
+        return bom_encoding
+
+    decoder = codecs.getincrementaldecoder('utf_8')()
+
+    try:
+        while True:
+            decoder.decode(chunk, not chunk)
+
+            if not chunk:
+                return 'utf_8'
+
+            chunk = read(chunk_size)
+    except UnicodeDecodeError:
+        return 'iso-8859-1'
+
+# Token kinds written as words, separated by a space when adjacent
+_WORD_KINDS = Literal.KIND_BIT | Keyword.KIND_BIT | Identifier.KIND_BIT
+
+def _reformat(tokens, write, batch_size):
+    """ Writes the reformatted text of tokens by calling write with the
+    concatenation of every batch_size pieces of output.
+
+    """
+
     indent = 0
+    padding = ''
     closed_block = False
     ident_last = False
 
     output = list()
+    append = output.append
 
     for token in tokens:
+        value = token.value
+        is_word = token.KIND_MASK & _WORD_KINDS
+
         if closed_block:
             closed_block = False
             indent -= 4
+            padding = ' ' * indent
 
-            output.append('\n')
-            output.append(' ' * indent)
-            output.append('}')
+            append('\n')
+            append(padding)
+            append('}')
 
-            if isinstance(token, (Literal, Keyword, Identifier)):
-                output.append('\n')
-                output.append(' ' * indent)
+            if is_word:
+                append('\n')
+                append(padding)
 
-        if token.value == '{':
+        if value == '{':
             indent += 4
-            output.append(' {\n')
-            output.append(' ' * indent)
+            padding = ' ' * indent
+            append(' {\n')
+            append(padding)
 
-        elif token.value == '}':
+        elif value == '}':
             closed_block = True
 
-        elif token.value == ',':
-            output.append(', ')
+        elif value == ',':
+            append(', ')
 
-        elif isinstance(token, (Literal, Keyword, Identifier)):
+        elif is_word:
             if ident_last:
                 # If the last token was a literla/keyword/identifer put a space in between
-                output.append(' ')
-            ident_last = True
-            output.append(token.value)
+                append(' ')
+            append(value)
 
-        elif isinstance(token, Operator):
-            output.append(' ' + token.value + ' ')
+        elif token.KIND_MASK & Operator.KIND_BIT:
+            append(' ' + value + ' ')
 
-        elif token.value == ';':
-            output.append(';\n')
-            output.append(' ' * indent)
+        elif value == ';':
+            append(';\n')
+            append(padding)
 
         else:
-            output.append(token.value)
+            append(value)
 
-        ident_last = isinstance(token, (Literal, Keyword, Identifier))
+        ident_last = is_word
+
+        if len(output) >= batch_size:
+            write(''.join(output))
+            del output[:]
 
     if closed_block:
-        output.append('\n}')
+        append('\n}')
+
+    append('\n')
+
+    write(''.join(output))
+
+def reformat_tokens(tokens):
+    chunks = list()
+    _reformat(tokens, chunks.append, 65536)
+    return ''.join(chunks)
+
+def write_reformatted(tokens, fileobj, batch_size=4096):
+    """ Writes the text reformat_tokens would return for tokens to the text
+    file object fileobj. Tokens are consumed as the output is written, in
+    writes of batch_size pieces, so memory use does not grow with the size
+    of the input.
 
-    output.append('\n')
+    """
 
-    return ''.join(output)
+    _reformat(tokens, fileobj.write, batch_size)
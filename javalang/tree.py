@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
+import six
+
 from .ast import Node
+from . import javadoc
 
 # ------------------------------------------------------------------------------
 SEPERATOR = "\r\n"
@@ -44,6 +47,32 @@ class Documented(Node):
     """
     attrs = ("documentation",)
 
+    # The parser may set documentation to the JavadocSpan recorded by the
+    # tokenizer, in which case the text is only sliced out on first access
+    @property
+    def documentation(self):
+        documentation = self._documentation
+
+        if not (documentation is None
+                or isinstance(documentation, six.string_types)):
+            documentation = self._documentation = documentation.text
+
+        return documentation
+
+    @documentation.setter
+    def documentation(self, documentation):
+        self._documentation = documentation
+        self._doc_block = None
+
+    @property
+    def doc_block(self):
+        """ The documentation parsed into a javadoc.DocBlock, or None """
+
+        if self._doc_block is None and self.documentation:
+            self._doc_block = javadoc.parse(self.documentation)
+
+        return self._doc_block
+
 class Declaration(Node):
     """
         modifers: List of String (of modifiers)
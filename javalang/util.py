@@ -1,3 +1,4 @@
+import sys
 
 
 class LookAheadIterator(object):
@@ -89,7 +90,16 @@ class LookAheadIterator(object):
 
 class LookAheadListIterator(object):
     def __init__(self, iterable):
-        self.list = list(iterable)
+        if hasattr(iterable, 'value_at'):
+            # Columnar sequences (see tokenizer.TokenStream) are used in place
+            # so that look_value() and friends never materialize items
+            self.list = iterable
+            self.value_at = iterable.value_at
+            self.type_at = iterable.type_at
+            self.position_at = iterable.position_at
+        else:
+            self.list = list(iterable)
+            self.value_at = None
 
         self.marker = 0
         self.saved_markers = []
@@ -131,6 +141,49 @@ class LookAheadListIterator(object):
 
         return self.value
 
+    def look_value(self, i=0):
+        """ Returns the value attribute of the item look(i) would return
+        without materializing it if the underlying sequence provides
+        value_at().
+
+        """
+
+        try:
+            if self.value_at is None:
+                return self.list[self.marker + i].value
+            return self.value_at(self.marker + i)
+        except IndexError:
+            return self.default.value
+
+    def look_type(self, i=0):
+        """ Returns the type of the item look(i) would return """
+
+        try:
+            if self.value_at is None:
+                return type(self.list[self.marker + i])
+            return self.type_at(self.marker + i)
+        except IndexError:
+            return type(self.default)
+
+    def look_position(self, i=0):
+        """ Returns the position attribute of the item look(i) would return """
+
+        try:
+            if self.value_at is None:
+                return self.list[self.marker + i].position
+            return self.position_at(self.marker + i)
+        except IndexError:
+            return self.default.position
+
+    def skip(self, count=1):
+        """ Advance past count values without returning them """
+
+        if self.marker + count > len(self.list):
+            self.marker = len(self.list)
+            raise StopIteration()
+
+        self.marker += count
+
     def last(self):
         return self.value
 
@@ -163,3 +216,45 @@ class LookAheadListIterator(object):
         elif self.saved_markers:
             self.saved_markers[-1] = saved
 
+
+class InternTable(object):
+    """ Maps strings to a single shared instance so that equal identifiers,
+    keywords and names produced by tokenizers and parsers which are given the
+    same table do not each keep their own copy.
+
+    If max_size is given no new strings are added once the table holds that
+    many, while strings already in the table are still shared.
+
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.strings = dict()
+
+        # Number of strings replaced by a shared instance and the memory the
+        # replaced strings occupied
+        self.hits = 0
+        self.bytes_saved = 0
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __contains__(self, value):
+        return value in self.strings
+
+    def intern(self, value):
+        if value is None:
+            return value
+
+        shared = self.strings.get(value)
+
+        if shared is None:
+            if self.max_size is None or len(self.strings) < self.max_size:
+                self.strings[value] = value
+            return value
+
+        if shared is not value:
+            self.hits += 1
+            self.bytes_saved += sys.getsizeof(value)
+
+        return shared